@@ -0,0 +1,170 @@
+""" Offline analysis of many Teeko positions.
+
+Reads positions one per line, searches each with TeekoPlayer's iterative
+deepening to a fixed depth and/or time budget, and writes one JSON object per
+position as soon as it (and every position before it) is done. Input is read
+lazily and only a few positions per worker are in flight at a time, so dumps
+of any size stream through in constant memory.
+
+A position line is the 25 cells in row order, 'b', 'r' or '.' for an empty
+square (rows may be separated by '/'), optionally followed by the color to
+move. Without one, black is to move when both colors have as many pieces on
+the board (black moves first) and red otherwise. Blank lines and lines
+starting with '#' are skipped. These two lines are the same position:
+
+    ......br....b.....r...... b
+    ...../.br../..b../...r./.....
+
+Each output line has the input line number, the color to move, the best move
+in the [(row, col), (source_row, source_col)] format, its score from the
+mover's point of view (1 a win, -1 a loss), the depth reached, the nodes
+searched and the seconds taken. A position that is already won has no move,
+and a line that can't be parsed gets an error instead. Each worker keeps its
+player, and with it its transposition table, from one position to the next,
+so neighbouring positions of a game reuse each other's work; node counts
+therefore depend on what the same worker analyzed before.
+
+Usage:
+    python analyze.py positions.txt [--output results.jsonl] [--depth 4] [--time 1.0] [--workers 4]
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from game import FULL_BOARD, TeekoPlayer, decode_move, has_win, iter_squares
+
+DEFAULT_DEPTH = 4
+TASKS_PER_WORKER = 4  # positions queued per worker, enough to keep it busy without reading far ahead
+
+
+def parse_position(line):
+    """ Returns (mover bits, other bits, color to move) for a position line. """
+    fields = line.split()
+    cells = fields[0].replace('/', '') if fields else ''
+    if len(cells) != 25 or set(cells) - set('br.'):
+        raise ValueError("expected 25 cells of 'b', 'r' or '.'")
+    black = sum(1 << square for square, cell in enumerate(cells) if cell == 'b')
+    red = sum(1 << square for square, cell in enumerate(cells) if cell == 'r')
+    if len(fields) > 1:
+        color = fields[1]
+        if color not in ('b', 'r'):
+            raise ValueError(f"unknown color to move {color!r}")
+    else:
+        color = 'b' if black.bit_count() == red.bit_count() else 'r'
+    if black.bit_count() > 4 or red.bit_count() > 4:
+        raise ValueError("more than 4 pieces of one color")
+    return (black, red, color) if color == 'b' else (red, black, color)
+
+
+def format_position(mover, other, color):
+    """ The position line of a position, the inverse of parse_position. """
+    black, red = (mover, other) if color == 'b' else (other, mover)
+    cells = ['.'] * 25
+    for square in iter_squares(black):
+        cells[square] = 'b'
+    for square in iter_squares(red):
+        cells[square] = 'r'
+    return ''.join(cells) + ' ' + color
+
+
+# each worker (the process itself when there is only one) analyzes with its own long-lived player
+_worker = threading.local()
+
+
+def analyze_position(mover, other, depth=DEFAULT_DEPTH, time_budget=None):
+    """ Searches (mover, other) with mover to move. Returns a dict with the move (bits), score
+    from the mover's point of view, depth, nodes and seconds.
+    """
+    if getattr(_worker, 'player', None) is None:
+        _worker.player = TeekoPlayer()
+    player = _worker.player
+    if has_win(mover) or has_win(other):
+        return {'move': None, 'score': 1 if has_win(mover) else -1, 'depth': 0, 'nodes': 0, 'time': 0.0}
+    if not FULL_BOARD & ~(mover | other):
+        raise ValueError("the board is full")
+    start = time.perf_counter()
+    move = player.iterative_deepening(mover, other, math.inf if time_budget is None else time_budget,
+                                      player.MAX_DEPTH if depth is None else depth)
+    search = player.last_search
+    return {'move': move, 'score': search['value'], 'depth': search['depth'], 'nodes': search['nodes'],
+            'time': time.perf_counter() - start}
+
+
+#Runs in a worker: parses and analyzes one line. Errors are reported in the result rather than raised.
+def _analyze_line(number, line, depth, time_budget):
+    try:
+        mover, other, color = parse_position(line)
+        result = analyze_position(mover, other, depth, time_budget)
+    except Exception as error:
+        return {'line': number, 'position': line.strip(), 'error': str(error)}
+    move = result.pop('move')
+    return {'line': number, 'position': format_position(mover, other, color), 'to_move': color,
+            'move': None if move is None else decode_move(mover, move), **result}
+
+
+def _position_lines(lines):
+    for number, line in enumerate(lines, 1):
+        if line.strip() and not line.lstrip().startswith('#'):
+            yield number, line
+
+
+def analyze_lines(lines, depth=DEFAULT_DEPTH, time_budget=None, workers=1):
+    """ Yields the analysis of every position line of lines (any iterable, e.g. an open file),
+    in input order. With workers > 1 the positions are searched by a pool of processes, with at
+    most TASKS_PER_WORKER of them per worker read ahead.
+
+    Args:
+        depth (int): deepest iteration per position; None for no limit (then give time_budget).
+        time_budget (float): seconds per position; None for no limit.
+        workers (int): processes searching positions in parallel.
+    """
+    if workers <= 1:
+        for number, line in _position_lines(lines):
+            yield _analyze_line(number, line, depth, time_budget)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for number, line in _position_lines(lines):
+            pending.append(pool.submit(_analyze_line, number, line, depth, time_budget))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the best move and score of every position in a file.")
+    parser.add_argument('input', help="file with one position per line, or - for standard input")
+    parser.add_argument('--output', default=None, help="where to write the JSON lines (default standard output)")
+    parser.add_argument('--depth', type=int, default=None,
+                        help=f"deepest iteration per position (default {DEFAULT_DEPTH}, or none with --time)")
+    parser.add_argument('--time', type=float, default=None, help="seconds per position")
+    parser.add_argument('--workers', type=int, default=1, help="processes searching positions in parallel")
+    args = parser.parse_args(argv)
+
+    depth = args.depth if args.depth is not None or args.time is not None else DEFAULT_DEPTH
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    failed = 0
+    try:
+        for result in analyze_lines(source, depth, args.time, args.workers):
+            failed += 'error' in result
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    if failed:
+        print(f"{failed} lines could not be analyzed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
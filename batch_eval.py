@@ -0,0 +1,100 @@
+""" Vectorized evaluation of many Teeko positions at once with NumPy.
+
+These are batch versions of TeekoPlayer.game_value and heuristic_game_value
+that give the same values (up to floating point rounding). A batch of positions is an (N, 25) int8 array
+with 1 for the player's pieces, -1 for the opponent's and 0 for empty squares,
+squares numbered row * 5 + col as in the bitboards.
+
+Each pattern family is a 0/1 matrix with one column per pattern, so multiplying
+the pieces of one side by it counts, for every position and every pattern, how
+many of the pattern's squares that side holds:
+
+    WIN_MATRIX         the 44 winning patterns, won when a count reaches 4
+    THREE_LINE_MATRIX  the 30 horizontal/vertical runs of three, scored at 3
+    BOX_MATRIX         the 16 2x2 boxes, scored when a count reaches 3
+
+The heuristic looks up each of the 44 winning patterns' (mine, theirs) counts
+in the player's pattern value table, and gets mobility from ADJACENCY_MATRIX.
+
+NumPy is only needed for this module; the rest of the engine runs without it.
+"""
+import numpy as np
+
+from game import (DEFAULT_WEIGHTS, HEURISTIC_SCALE, NEIGHBOR_MASKS, NUM_SQUARES, PIECES_PER_SIDE, SQUARE_CENTRALITY,
+                  THREE_BOX_MASKS, THREE_LINE_MASKS, WIN_MASKS, iter_squares, pattern_value_table)
+
+
+def _mask_matrix(masks):
+    matrix = np.zeros((NUM_SQUARES, len(masks)), dtype=np.float32)
+    for column, mask in enumerate(masks):
+        for square in iter_squares(mask):
+            matrix[square, column] = 1
+    return matrix
+
+
+WIN_MATRIX = _mask_matrix(WIN_MASKS)
+THREE_LINE_MATRIX = _mask_matrix(THREE_LINE_MASKS)
+BOX_MATRIX = _mask_matrix([corners[0] | corners[1] for corners in THREE_BOX_MASKS])
+# ADJACENCY_MATRIX[a, b] is 1 when a piece on a can slide to b
+ADJACENCY_MATRIX = _mask_matrix(NEIGHBOR_MASKS)
+_SQUARE_SHIFTS = np.arange(NUM_SQUARES, dtype=np.int64)
+
+
+def boards_from_bits(mine, theirs):
+    """ Builds a batch from sequences of (my bits, opponent bits). """
+    mine = np.asarray(mine, dtype=np.int64)[:, None]
+    theirs = np.asarray(theirs, dtype=np.int64)[:, None]
+    return ((mine >> _SQUARE_SHIFTS) & 1).astype(np.int8) - ((theirs >> _SQUARE_SHIFTS) & 1).astype(np.int8)
+
+
+def _has_wins(pieces):
+    return (pieces @ WIN_MATRIX == 4).any(axis=1)
+
+
+def game_values(boards):
+    """ game_value for every position: 1 if the player has won, -1 if the opponent has, else 0. """
+    mine = (boards == 1).astype(np.float32)
+    theirs = (boards == -1).astype(np.float32)
+    return np.where(_has_wins(mine), 1, np.where(_has_wins(theirs), -1, 0)).astype(np.int8)
+
+
+def three_pattern_scores(pieces):
+    """ check_three_in_a_row for every row of a 0/1 float32 (N, 25) array of one side's pieces. """
+    runs = (pieces @ THREE_LINE_MATRIX == 3).sum(axis=1)
+    boxes = (pieces @ BOX_MATRIX >= 3).sum(axis=1)
+    return 0.5 * (runs + boxes)
+
+
+def heuristic_tables(weights=DEFAULT_WEIGHTS):
+    """ The arrays heuristic_values needs for a player's heuristic weights: the pattern value
+    table, every square's centrality value and the mobility weight.
+    """
+    return (np.array(pattern_value_table(weights), dtype=np.float64),
+            weights['center'] * np.array(SQUARE_CENTRALITY, dtype=np.float64),
+            weights['mobility'])
+
+
+_DEFAULT_TABLES = heuristic_tables()
+
+
+def heuristic_values(boards, tables=None, terminal=None):
+    """ heuristic_game_value for every position. tables comes from heuristic_tables and
+    defaults to DEFAULT_WEIGHTS; terminal can pass in game_values(boards) if the caller
+    already has it.
+    """
+    if tables is None:
+        tables = _DEFAULT_TABLES
+    values, centrality, mobility_weight = tables
+    if terminal is None:
+        terminal = game_values(boards)
+    mine = (boards == 1).astype(np.float32)
+    theirs = (boards == -1).astype(np.float32)
+    counts = (mine @ WIN_MATRIX).astype(np.int64) * 5 + (theirs @ WIN_MATRIX).astype(np.int64)
+    score = values[counts].sum(axis=1) + (mine - theirs).astype(np.float64) @ centrality
+    if mobility_weight:
+        empty = (boards == 0).astype(np.float32)
+        moves = ((mine @ ADJACENCY_MATRIX) * empty).sum(axis=1) - ((theirs @ ADJACENCY_MATRIX) * empty).sum(axis=1)
+        move_phase = (mine.sum(axis=1) + theirs.sum(axis=1)) == 2 * PIECES_PER_SIDE
+        score += np.where(move_phase, mobility_weight * moves.astype(np.float64), 0.0)
+    score = score / (np.abs(score) + HEURISTIC_SCALE)
+    return np.where(terminal != 0, terminal, score)
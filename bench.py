@@ -0,0 +1,230 @@
+""" Performance benchmarks for the Teeko engine.
+
+Runs a fixed corpus of positions (early drop phase, mid drop phase and move
+phase), each with a fixed color to move, so that every run measures the same
+work. Two kinds of numbers are collected:
+
+    search  iterative deepening from each position to a fixed depth: time to
+            reach each depth, nodes per second and the effective branching factor
+            (nodes of the last iteration / nodes of the one before)
+    micro   calls per second of succ, game_value and heuristic_game_value on the
+            list of lists boards, best of several repeats
+
+Results are written as JSON. Given a baseline file from an earlier run, every
+timing is compared against it and the run fails (exit status 1) if any is
+worse than the baseline by more than the threshold.
+
+With --profile the searches run instrumented (see profiler.py): the time per
+phase is printed, the per-move stats are written next to the stacks as JSON
+lines, and the call stacks in the folded format flame graph tools read. The
+instrumented timings are slower, so they are not compared against a baseline.
+
+Every default run also checks game.test_pvs_nodes on the corpus boards, with
+either color to move: principal variation search must find the same values as
+plain alpha-beta in no more nodes in total, or the run fails. With --plain the
+searches run without principal variation search and aspiration windows
+(TeekoPlayer(pvs=False)), for comparing node counts at the same depth against
+a default run.
+
+Usage:
+    python bench.py [--depth 5] [--output bench_results.json]
+                    [--baseline bench_baseline.json] [--threshold 0.15] [--save-baseline]
+                    [--profile bench.folded] [--plain]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+from game import TeekoPlayer, test_pvs_nodes
+from profiler import SearchProfiler
+
+# (name, phase, color to move, board rows with '.' for an empty square)
+CORPUS = [
+    ('empty', 'drop', 'b', ['.....', '.....', '.....', '.....', '.....']),
+    ('first-reply', 'drop', 'r', ['.....', '.....', '..b..', '.....', '.....']),
+    ('mid-drop-4', 'mid-drop', 'b', ['.....', '.br..', '..b..', '...r.', '.....']),
+    ('mid-drop-5', 'mid-drop', 'r', ['b....', '.r...', '..br.', '.b...', '.....']),
+    ('mid-drop-6', 'mid-drop', 'b', ['..r..', '.b.b.', '..r..', '..b..', '....r']),
+    ('move-diagonal', 'move', 'b', ['b....', '.rb..', '..r.b', '.b.r.', 'r....']),
+    ('move-threat', 'move', 'b', ['....r', '.bb..', '.rrr.', '.b.b.', '.....']),
+    ('move-open', 'move', 'r', ['.b...', 'br...', '.r.r.', '..r.b', '....b']),
+]
+
+MICRO_REPEATS = 5
+MICRO_CALLS = 2000
+# searches faster than this are dominated by timer noise and are not compared against the baseline
+MIN_COMPARED_SECONDS = 0.05
+
+
+def corpus_state(rows):
+    return [[' ' if cell == '.' else cell for cell in row] for row in rows]
+
+
+def corpus_player(color, profiler=None, pvs=True):
+    player = TeekoPlayer(profiler=profiler, pvs=pvs)
+    player.my_piece = color
+    player.opp = 'r' if color == 'b' else 'b'
+    return player
+
+
+def bench_search(depth, profiler=None, pvs=True):
+    """ Iterative deepening to depth from every corpus position with a fresh player. """
+    results = {}
+    for name, phase, color, rows in CORPUS:
+        player = corpus_player(color, profiler, pvs)
+        state = corpus_state(rows)
+        start = time.perf_counter()
+        # the search itself, without the shortcuts make_move takes for book, tablebase and threat positions
+        player.iterative_deepening(*player.encode(state), math.inf, depth)
+        elapsed = time.perf_counter() - start
+        search = player.last_search
+        iterations = search['iterations']
+        branching = (iterations[-1][1] / iterations[-2][1]
+                     if len(iterations) > 1 and iterations[-2][1] else None)
+        results[name] = {'phase': phase,
+                         'depth': search['depth'],
+                         'nodes': search['nodes'],
+                         'time': elapsed,
+                         'nodes_per_sec': search['nodes'] / elapsed if elapsed else None,
+                         'time_to_depth': {str(d): seconds for d, nodes, seconds in iterations},
+                         'effective_branching_factor': branching}
+    return results
+
+
+def _best_rate(function, arguments):
+    best = math.inf
+    for repeat in range(MICRO_REPEATS):
+        start = time.perf_counter()
+        for call in range(MICRO_CALLS):
+            function(arguments[call % len(arguments)])
+        best = min(best, time.perf_counter() - start)
+    return MICRO_CALLS / best
+
+
+def bench_micro():
+    """ Calls per second of the list of lists API on the corpus boards. """
+    player = corpus_player('b')
+    states = [corpus_state(rows) for name, phase, color, rows in CORPUS]
+    return {'succ': {'calls_per_sec': _best_rate(player.succ, states)},
+            'game_value': {'calls_per_sec': _best_rate(player.game_value, states)},
+            'heuristic_game_value': {'calls_per_sec': _best_rate(player.heuristic_game_value, states)}}
+
+
+def run_benchmarks(depth=5, pvs=True):
+    return {'meta': {'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'depth': depth,
+                     'pvs': pvs,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'search': bench_search(depth, pvs=pvs),
+            'micro': bench_micro()}
+
+
+def _timings(results):
+    """ Every timing as name -> (value, True if higher is better). """
+    timings = {}
+    for name, search in results['search'].items():
+        if search['time'] < MIN_COMPARED_SECONDS:
+            continue
+        timings[f'search.{name}.time'] = (search['time'], False)
+        timings[f'search.{name}.nodes_per_sec'] = (search['nodes_per_sec'], True)
+    for name, micro in results['micro'].items():
+        timings[f'micro.{name}.calls_per_sec'] = (micro['calls_per_sec'], True)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    """ Returns a list of (name, baseline value, current value, relative change) for every
+    timing that got worse than the baseline by more than threshold (0.15 = 15%).
+    Searches that took less than MIN_COMPARED_SECONDS in the baseline are skipped.
+    """
+    if baseline['meta']['depth'] != results['meta']['depth']:
+        raise ValueError("baseline was recorded at a different search depth")
+    current = _timings(results)
+    regressions = []
+    for name, (old, higher_is_better) in _timings(baseline).items():
+        if name not in current or not old:
+            continue
+        new = current[name][0]
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        if worse > threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def profile_searches(depth, folded_path):
+    """ Runs the search benchmarks instrumented, printing the time per phase. """
+    stats_path = os.path.splitext(folded_path)[0] + '.jsonl'
+    with open(stats_path, 'w') as log:
+        profiler = SearchProfiler(log)
+        bench_search(depth, profiler)
+    profiler.write_folded(folded_path)
+    totals = profiler.phase_totals()
+    total = sum(totals.values())
+    for phase, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+        print(f"{phase:10} {seconds:8.3f}s  {seconds / total:6.1%}")
+    print(f"Wrote {folded_path} and {stats_path}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Teeko search and compare against a baseline.")
+    parser.add_argument('--depth', type=int, default=5, help="iterative deepening depth for the search benchmarks")
+    parser.add_argument('--output', default='bench_results.json', help="where to write this run's results")
+    parser.add_argument('--baseline', default=None, help="results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="allowed slowdown, as a fraction")
+    parser.add_argument('--save-baseline', action='store_true', help="also write this run to --baseline")
+    parser.add_argument('--profile', metavar='FOLDED', default=None,
+                        help="profile the searches and write their call stacks here (skips the micro benchmarks)")
+    parser.add_argument('--plain', action='store_true',
+                        help="search without principal variation search and aspiration windows, to compare node counts")
+    args = parser.parse_args(argv)
+    if args.save_baseline and args.baseline is None:
+        parser.error("--save-baseline needs --baseline, the file to save to")
+
+    if args.profile is not None:
+        return profile_searches(args.depth, args.profile)
+
+    results = run_benchmarks(args.depth, not args.plain)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    for name, search in results['search'].items():
+        branching = search['effective_branching_factor']
+        print(f"{name:16} depth {search['depth']}  {search['time']:8.3f}s  {search['nodes']:8d} nodes  "
+              f"{search['nodes_per_sec']:9.0f} nodes/s  EBF {branching if branching is None else round(branching, 2)}")
+    for name, micro in results['micro'].items():
+        print(f"{name:22} {micro['calls_per_sec']:10.0f} calls/s")
+
+    if not args.plain:
+        try:
+            test_pvs_nodes([corpus_state(rows) for name, phase, color, rows in CORPUS], args.depth)
+        except AssertionError:
+            print("FAILED: principal variation search needed more nodes than plain search or found other values")
+            return 1
+
+    if args.baseline is None:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.threshold)
+    for name, old, new, change in regressions:
+        print(f"REGRESSION {name}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,739 @@
+import os
 import random
 import math
+from itertools import chain
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+############################################################################
+#
+# BITBOARD REPRESENTATION
+#
+# Square (row, col) is bit row * 5 + col, so one color fits in a 25-bit int and
+# a position is just two ints. Successors are built by flipping bits instead of
+# copying 5x5 lists, and win detection is a handful of mask comparisons.
+#
+############################################################################
+
+BOARD_SIZE = 5
+NUM_SQUARES = BOARD_SIZE * BOARD_SIZE
+FULL_BOARD = (1 << NUM_SQUARES) - 1
+PIECES_PER_SIDE = 4  # each side drops this many pieces, then moves them
+
+
+def square_bit(row, col):
+    return 1 << (row * BOARD_SIZE + col)
+
+
+def _line_mask(row, col, d_row, d_col, length):
+    return sum(square_bit(row + k * d_row, col + k * d_col) for k in range(length))
+
+
+def iter_squares(bits):
+    """ Yields the square index of every set bit, lowest first. """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+#All 44 winning patterns: 10 horizontal, 10 vertical, 4 \ diagonal, 4 / diagonal and 16 2x2 boxes.
+def _build_win_masks():
+    masks = []
+    for row in range(5):
+        for col in range(2):
+            masks.append(_line_mask(row, col, 0, 1, 4))
+    for col in range(5):
+        for row in range(2):
+            masks.append(_line_mask(row, col, 1, 0, 4))
+    for row in range(2):
+        for col in range(2):
+            masks.append(_line_mask(row, col, 1, 1, 4))
+    for row in range(2):
+        for col in range(3, 5):
+            masks.append(_line_mask(row, col, 1, -1, 4))
+    for row in range(4):
+        for col in range(4):
+            masks.append(square_bit(row, col) | square_bit(row + 1, col) |
+                         square_bit(row, col + 1) | square_bit(row + 1, col + 1))
+    return tuple(masks)
+
+
+#Patterns scored by check_three_in_a_row: horizontal and vertical runs of three, plus for every
+#2x2 box its four 3-square corners (a box scores once if any of them is filled).
+def _build_three_masks():
+    lines = []
+    for row in range(5):
+        for col in range(3):
+            lines.append(_line_mask(row, col, 0, 1, 3))
+    for col in range(5):
+        for row in range(3):
+            lines.append(_line_mask(row, col, 1, 0, 3))
+    boxes = []
+    for row in range(4):
+        for col in range(4):
+            box = (square_bit(row, col) | square_bit(row + 1, col) |
+                   square_bit(row, col + 1) | square_bit(row + 1, col + 1))
+            boxes.append(tuple(box ^ (1 << square) for square in iter_squares(box)))
+    return tuple(lines), tuple(boxes)
+
+
+#For every square, the mask of the (up to 8) squares adjacent to it.
+def _build_neighbor_masks():
+    masks = []
+    for row in range(5):
+        for col in range(5):
+            mask = 0
+            for d_row in (-1, 0, 1):
+                for d_col in (-1, 0, 1):
+                    if (d_row or d_col) and 0 <= row + d_row < 5 and 0 <= col + d_col < 5:
+                        mask |= square_bit(row + d_row, col + d_col)
+            masks.append(mask)
+    return tuple(masks)
+
+
+# Geometry tables, built once at import (about half a millisecond in all) so that no hot path works out rows, columns or
+# board edges again: every square's (row, col) and bit, the squares next to it (as a mask and as a list),
+# the winning patterns (as masks, and per square the indexes of those through it) and the near-win
+# patterns check_three_in_a_row scores.
+SQUARE_COORDS = tuple(divmod(square, BOARD_SIZE) for square in range(NUM_SQUARES))
+SQUARE_BITS = tuple(1 << square for square in range(NUM_SQUARES))
+WIN_MASKS = _build_win_masks()
+THREE_LINE_MASKS, THREE_BOX_MASKS = _build_three_masks()
+NEIGHBOR_MASKS = _build_neighbor_masks()
+SQUARE_NEIGHBORS = tuple(tuple(iter_squares(mask)) for mask in NEIGHBOR_MASKS)
+# SQUARE_PATTERNS[square] lists the indexes into WIN_MASKS of the patterns through that square
+SQUARE_PATTERNS = tuple(tuple(index for index, mask in enumerate(WIN_MASKS) if mask >> square & 1)
+                        for square in range(NUM_SQUARES))
+
+
+#Squares a pattern may start on, so that shifting by the pattern's step never wraps around a row.
+def _start_mask(rows, cols):
+    return sum(square_bit(row, col) for row in rows for col in cols)
+
+
+_COLS_0_1 = _start_mask(range(5), range(2))
+_ROWS_0_1 = _start_mask(range(2), range(5))
+_DIAG_DOWN_START = _start_mask(range(2), range(2))
+_DIAG_UP_START = _start_mask(range(2), range(3, 5))
+_BOX_START = _start_mask(range(4), range(4))
+_COLS_0_2 = _start_mask(range(5), range(3))
+_ROWS_0_2 = _start_mask(range(3), range(5))
+_NOT_COL_0 = _start_mask(range(5), range(1, 5))
+_NOT_COL_4 = _start_mask(range(5), range(4))
+
+
+def encode_state(state, piece):
+    """ Packs every cell of state holding piece into a 25-bit integer. """
+    bits = 0
+    for bit, cell in zip(SQUARE_BITS, chain.from_iterable(state)):
+        if cell == piece:
+            bits |= bit
+    return bits
+
+
+def decode_state(bits_by_piece):
+    """ Unpacks a {piece: bits} mapping back into the list of lists format. """
+    state = [[' ' for j in range(5)] for i in range(5)]
+    for piece, bits in bits_by_piece.items():
+        for square in iter_squares(bits):
+            row, col = SQUARE_COORDS[square]
+            state[row][col] = piece
+    return state
+
+
+def encode_move(move):
+    """ The bits a move in the [(row, col), (source_row, source_col)] format flips. """
+    bits = square_bit(*move[0])
+    if len(move) > 1:
+        bits |= square_bit(*move[1])
+    return bits
+
+
+def decode_move(mover, move):
+    """ Turns the bits flipped by one of mover's moves into the [(row, col), (source_row, source_col)] format. """
+    destination = (move & ~mover).bit_length() - 1
+    source = move & mover
+    if source:
+        source = source.bit_length() - 1
+        return [(destination // 5, destination % 5), (source // 5, source % 5)]
+    return [(destination // 5, destination % 5)]
+
+
+def has_win(bits):
+    """ True if the given color's bits cover one of the 44 patterns in WIN_MASKS.
+
+    Rather than testing the masks one by one, each pattern family is checked at
+    once by and-ing the board with itself shifted along the pattern's step.
+    """
+    if bits.bit_count() < 4:
+        return False
+    return bool((bits & bits >> 1 & bits >> 2 & bits >> 3 & _COLS_0_1) or
+                (bits & bits >> 5 & bits >> 10 & bits >> 15 & _ROWS_0_1) or
+                (bits & bits >> 6 & bits >> 12 & bits >> 18 & _DIAG_DOWN_START) or
+                (bits & bits >> 4 & bits >> 8 & bits >> 12 & _DIAG_UP_START) or
+                (bits & bits >> 1 & bits >> 5 & bits >> 6 & _BOX_START))
+
+
+def generate_moves(mover, other, drop=None):
+    """ Lazily yields the mover's legal moves, each as the bits it flips (mover ^ child).
+
+    The phase is decided for the mover alone: while it has fewer than PIECES_PER_SIDE
+    pieces every empty square is a drop (one bit); afterwards each of its pieces may
+    slide to an adjacent empty square (the source and destination bits). Callers that
+    already know the mover's piece count can pass drop instead of having it recounted.
+    """
+    empty = FULL_BOARD & ~(mover | other)
+    if drop is None:
+        drop = mover.bit_count() < PIECES_PER_SIDE
+    if drop:
+        while empty:
+            low = empty & -empty
+            yield low
+            empty ^= low
+    else:
+        pieces = mover
+        while pieces:
+            source = pieces & -pieces
+            pieces ^= source
+            targets = NEIGHBOR_MASKS[source.bit_length() - 1] & empty
+            while targets:
+                target = targets & -targets
+                yield source | target
+                targets ^= target
+
+
+def bit_successors(mover, other):
+    """ Returns the mover's bits after every legal move, with other left untouched. """
+    return [mover ^ move for move in generate_moves(mover, other)]
+
+
+def three_pattern_score(bits):
+    """ Bitboard version of check_three_in_a_row: 0.5 per run of three and per box corner
+    (see THREE_LINE_MASKS and THREE_BOX_MASKS), counted with the same shift trick as has_win.
+    """
+    if bits.bit_count() < 3:
+        return 0.0
+    runs = ((bits & bits >> 1 & bits >> 2 & _COLS_0_2).bit_count() +
+            (bits & bits >> 5 & bits >> 10 & _ROWS_0_2).bit_count())
+    top_left, top_right, bottom_left, bottom_right = bits, bits >> 1, bits >> 5, bits >> 6
+    corners = ((top_left & top_right & (bottom_left | bottom_right)) |
+               (bottom_left & bottom_right & (top_left | top_right))) & _BOX_START
+    return 0.5 * (runs + corners.bit_count())
+
+
+############################################################################
+#
+# PATTERN HEURISTIC
+#
+# A winning pattern that only one side has pieces in is still open for that
+# side, and is worth more the more of its squares that side holds. A position
+# is scored by its open patterns (all 44 in WIN_MASKS), by how central each
+# side's pieces are and, once all pieces are down, by how many moves each side
+# has. The search keeps per-pattern piece counts up to date as moves are made
+# (see TeekoPlayer.do_move), so a leaf costs nothing to score and a move only
+# touches the patterns through the squares it changes.
+#
+############################################################################
+
+# how central a square is: the number of winning patterns through it, from 4 in a corner to 12 in the middle
+SQUARE_CENTRALITY = tuple(len(patterns) for patterns in SQUARE_PATTERNS)
+
+# two/three: value of an open pattern holding 2/3 of its squares; center: per piece per unit of
+# SQUARE_CENTRALITY; mobility: per legal move more than the opponent, in the move phase only
+DEFAULT_WEIGHTS = {'two': 1.0, 'three': 4.0, 'center': 0.125, 'mobility': 0.25}
+# raw scores are squashed into (-1, 1) by raw / (|raw| + HEURISTIC_SCALE), so that wins and losses still
+# come first while no difference between two positions is lost to clamping
+HEURISTIC_SCALE = 10.0
+
+
+def pattern_value_table(weights):
+    """ The value of one pattern with mine of its squares held by the first side and theirs by the
+    second, from the first side's point of view, at index mine * 5 + theirs.
+    """
+    by_count = (0.0, 0.0, weights['two'], weights['three'], 0.0)
+    return tuple(by_count[mine] if theirs == 0 else -by_count[theirs] if mine == 0 else 0.0
+                 for mine in range(5) for theirs in range(5))
+
+
+def pattern_counts(bits):
+    """ How many squares of each pattern in WIN_MASKS bits holds. """
+    return [(bits & mask).bit_count() for mask in WIN_MASKS]
+
+
+def mobility(mover, other):
+    """ Number of slides the mover has; only meaningful once its pieces are all down.
+    Each of the 8 directions is one shift of the mover's pieces onto the empty squares.
+    """
+    empty = FULL_BOARD & ~(mover | other)
+    east, west = mover & _NOT_COL_4, mover & _NOT_COL_0
+    return ((east << 1 & empty).bit_count() + (west >> 1 & empty).bit_count() +
+            (mover << 5 & empty).bit_count() + (mover >> 5 & empty).bit_count() +
+            (east << 6 & empty).bit_count() + (east >> 4 & empty).bit_count() +
+            (west << 4 & empty).bit_count() + (west >> 6 & empty).bit_count())
+
+
+def raw_pattern_score(mine, theirs, values, center):
+    """ The open pattern and centrality part of the heuristic from scratch, unsquashed;
+    values is a pattern_value_table and center the center weight.
+    """
+    score = 0.0
+    for mask in WIN_MASKS:
+        score += values[(mine & mask).bit_count() * 5 + (theirs & mask).bit_count()]
+    for square in iter_squares(mine):
+        score += center * SQUARE_CENTRALITY[square]
+    for square in iter_squares(theirs):
+        score -= center * SQUARE_CENTRALITY[square]
+    return score
+
+
+############################################################################
+#
+# THREATS
+#
+# A threat is a winning pattern one side holds 3 squares of while the other
+# side holds none: the side wins by filling the fourth square, if it still has
+# a drop left or a piece outside the pattern next to that square. A side facing
+# a threat must block it at once, and a side with two threats on different
+# squares (a double threat) usually can't be stopped. forced_win searches only
+# the moves that keep making threats, with the opponent limited to the replies
+# that block them, so it proves such wins several moves deep long before a full
+# width search of the same depth would finish.
+#
+############################################################################
+
+#The squares that complete a pattern of one family: those whose pattern, starting at a square in starts and
+#continuing at the given offsets, has the mover on its other three squares and this one empty.
+def _family_completions(mover, empty, starts, second, third, fourth):
+    mover_2, mover_3, mover_4 = mover >> second, mover >> third, mover >> fourth
+    mover &= starts
+    return ((empty & starts & mover_2 & mover_3 & mover_4) |
+            (mover & empty >> second & mover_3 & mover_4) << second |
+            (mover & mover_2 & empty >> third & mover_4) << third |
+            (mover & mover_2 & mover_3 & empty >> fourth) << fourth)
+
+
+def threat_squares(mover, other):
+    """ The empty squares that would complete one of the mover's winning patterns,
+    found family by family with the same shifts as has_win.
+    """
+    if mover.bit_count() < 3:
+        return 0
+    empty = FULL_BOARD & ~(mover | other)
+    return (_family_completions(mover, empty, _COLS_0_1, 1, 2, 3) |
+            _family_completions(mover, empty, _ROWS_0_1, 5, 10, 15) |
+            _family_completions(mover, empty, _DIAG_DOWN_START, 6, 12, 18) |
+            _family_completions(mover, empty, _DIAG_UP_START, 4, 8, 12) |
+            _family_completions(mover, empty, _BOX_START, 1, 5, 6))
+
+
+def winning_moves(mover, other):
+    """ The mover's moves (as the bits they flip) that win at once. """
+    squares = threat_squares(mover, other)
+    if not squares:
+        return []
+    if mover.bit_count() < PIECES_PER_SIDE:
+        return [1 << square for square in iter_squares(squares)]
+    moves = []
+    for square in iter_squares(squares):
+        target = 1 << square
+        for source in iter_squares(NEIGHBOR_MASKS[square] & mover):
+            # the piece that slides in must not be one of the pattern's own three
+            if has_win(mover ^ (1 << source) | target):
+                moves.append(1 << source | target)
+    return moves
+
+
+def blocking_moves(mover, other):
+    """ If other threatens to win on its next move, the mover's moves that stop every such win;
+    None if there is no threat to answer.
+    """
+    if not winning_moves(other, mover):
+        return None
+    return [move for move in generate_moves(mover, other) if not winning_moves(other, mover ^ move)]
+
+
+def forced_win(mover, other, depth):
+    """ A move that wins by force for the mover within depth of its own moves, found by threat
+    space search, or None. Only moves that create a threat (and answer any threat of the
+    opponent) are tried; every opponent reply that doesn't lose at once is checked, so a move
+    returned here really wins, while None only means no such line was found.
+    """
+    wins = winning_moves(mover, other)
+    if wins:
+        return wins[0]
+    if depth <= 1:
+        return None
+    for move in generate_moves(mover, other):
+        child = mover ^ move
+        if winning_moves(other, child) or not winning_moves(child, other):
+            continue
+        if _threat_holds(child, other, depth - 1):
+            return move
+    return None
+
+
+#Whether every reply of other to the mover's threats loses, within depth more moves of the mover.
+def _threat_holds(mover, other, depth):
+    replies = 0
+    for reply in generate_moves(other, mover):
+        replies += 1
+        if winning_moves(mover, other ^ reply):
+            continue  # the threat wasn't blocked
+        if forced_win(mover, other ^ reply, depth) is None:
+            return False
+    # with no legal reply at all the game doesn't end in a win, so that is no proof
+    return replies > 0
+
+
+############################################################################
+#
+# SYMMETRY
+#
+# The board has the 8 symmetries of the square (4 rotations, 4 reflections)
+# and every win pattern and heuristic pattern maps onto another one under
+# each of them, so symmetric positions have the same value. SYMMETRIES[s]
+# maps each square to its image under symmetry s; to transform a whole
+# bitboard, each row's 5 bits are looked up in a 32-entry table per row.
+#
+############################################################################
+
+def _build_symmetries():
+    images = (lambda row, col: (row, col),          # identity
+              lambda row, col: (col, 4 - row),      # rotate 90
+              lambda row, col: (4 - row, 4 - col),  # rotate 180
+              lambda row, col: (4 - col, row),      # rotate 270
+              lambda row, col: (row, 4 - col),      # mirror left-right
+              lambda row, col: (4 - row, col),      # mirror top-bottom
+              lambda row, col: (col, row),          # transpose
+              lambda row, col: (4 - col, 4 - row))  # anti-transpose
+    symmetries = []
+    for image in images:
+        permutation = []
+        for square in range(NUM_SQUARES):
+            row, col = image(square // 5, square % 5)
+            permutation.append(row * 5 + col)
+        symmetries.append(tuple(permutation))
+    return tuple(symmetries)
+
+
+def _build_row_tables(permutation):
+    tables = []
+    for row in range(5):
+        table = []
+        for row_bits in range(32):
+            image = 0
+            for col in iter_squares(row_bits):
+                image |= 1 << permutation[row * 5 + col]
+            table.append(image)
+        tables.append(tuple(table))
+    return tuple(tables)
+
+
+SYMMETRIES = _build_symmetries()
+INVERSE_SYMMETRIES = tuple(SYMMETRIES.index(tuple(permutation.index(square) for square in range(NUM_SQUARES)))
+                           for permutation in SYMMETRIES)
+_SYMMETRY_ROW_TABLES = tuple(_build_row_tables(permutation) for permutation in SYMMETRIES)
+
+
+def transform_bits(bits, symmetry):
+    """ Image of a bitboard under SYMMETRIES[symmetry]. """
+    table = _SYMMETRY_ROW_TABLES[symmetry]
+    return (table[0][bits & 31] | table[1][bits >> 5 & 31] | table[2][bits >> 10 & 31] |
+            table[3][bits >> 15 & 31] | table[4][bits >> 20])
+
+
+def canonical_form(mine, theirs):
+    """ Returns (mine, theirs, symmetry) for the canonical representative of a position.
+
+    The representative is the image with the smallest (mine, theirs) pair, and
+    symmetry is the index of the transformation that produced it, so a move found
+    on the canonical board maps back with INVERSE_SYMMETRIES[symmetry].
+    """
+    best = (mine, theirs, 0)
+    for symmetry in range(1, 8):
+        image = (transform_bits(mine, symmetry), transform_bits(theirs, symmetry), symmetry)
+        if image < best:
+            best = image
+    return best
+
+
+def canonical_key(mine, theirs):
+    """ A single int identifying a position up to symmetry, for caches keyed by position. """
+    mine, theirs, symmetry = canonical_form(mine, theirs)
+    return mine << NUM_SQUARES | theirs
+
+
+def stabilizer(mine, theirs):
+    """ The symmetries other than the identity that map the position onto itself. """
+    return [symmetry for symmetry in range(1, 8)
+            if transform_bits(mine, symmetry) == mine and transform_bits(theirs, symmetry) == theirs]
+
+
+def unique_successors(mover, other, children):
+    """ Drops children of (mover, other) that are mirror images of another child.
+
+    Two children can only be symmetric to each other through a symmetry of the
+    parent itself, so for asymmetric parents (nearly every position after the
+    first few drops) this returns children unchanged. Otherwise one child per
+    orbit is kept, the one with the smallest bits.
+    """
+    symmetries = stabilizer(mover, other)
+    if not symmetries:
+        return children
+    return [child for child in children
+            if all(child <= transform_bits(child, symmetry) for symmetry in symmetries)]
+
+
+############################################################################
+#
+# TRANSPOSITION TABLE
+#
+# The same Teeko position is reached through many different drop orders, so
+# search results are cached under a Zobrist hash: one random 64-bit key per
+# (side, square), xor-ed together. Making a move only flips one or two squares,
+# so the child's hash is the parent's hash xor-ed with those squares' keys.
+#
+############################################################################
+
+_zobrist_random = random.Random(0x7EEC0)
+# the two sides of a search position (see TeekoPlayer.do_move)
+# ZOBRIST_KEYS[MINE] is for the AI's pieces and ZOBRIST_KEYS[THEIRS] for the opponent's
+MINE, THEIRS = 0, 1
+ZOBRIST_KEYS = tuple(tuple(_zobrist_random.getrandbits(64) for square in range(NUM_SQUARES)) for side in range(2))
+# xor-ed in for min_value nodes, so that the same board with the opponent to move gets its own entry
+ZOBRIST_MIN_TO_MOVE = _zobrist_random.getrandbits(64)
+
+
+def zobrist_hash(mine, theirs, min_to_move=False):
+    """ Hash of a position from scratch; the search only uses this at the root. """
+    key = ZOBRIST_MIN_TO_MOVE if min_to_move else 0
+    for square in iter_squares(mine):
+        key ^= ZOBRIST_KEYS[0][square]
+    for square in iter_squares(theirs):
+        key ^= ZOBRIST_KEYS[1][square]
+    return key
+
+
+def zobrist_delta(move, side):
+    """ Hash change for flipping the one or two squares in move (parent ^ child bits) for the given side. """
+    keys = ZOBRIST_KEYS[side]
+    low = move & -move
+    delta = keys[low.bit_length() - 1]
+    if move != low:
+        delta ^= keys[(move ^ low).bit_length() - 1]
+    return delta
+
+
+# bound types stored with each value
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+# the bound a value turns into when it is negated (seen from the other side)
+_OPPOSITE_BOUNDS = (EXACT, UPPER_BOUND, LOWER_BOUND)
+
+
+class TranspositionTable:
+    """ A fixed-size cache of search results keyed by Zobrist hash.
+
+    The table holds a power-of-two number of buckets, as many as fit in max_bytes.
+    Each bucket has a depth-preferred slot, which keeps the deepest result seen
+    for that bucket in the current search, and an always-replace slot, which takes
+    everything else (including results pushed out of the depth-preferred slot).
+    Entries are (key, depth, value, bound, best_move, generation) tuples, where
+    depth is the remaining search depth below the position and best_move is the
+    bits flipped by the best move found.
+    """
+    ENTRY_BYTES = 160  # rough size of one entry tuple and its ints
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        buckets = max(1, max_bytes // (2 * self.ENTRY_BYTES))
+        self.size = 1 << (buckets.bit_length() - 1)
+        self.mask = self.size - 1
+        self.slots = [None] * (2 * self.size)
+        self.generation = 0
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    def probe(self, key):
+        """ Returns the entry stored for key, or None. """
+        index = 2 * (key & self.mask)
+        for entry in (self.slots[index], self.slots[index + 1]):
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, value, bound, best_move):
+        index = 2 * (key & self.mask)
+        entry = (key, depth, value, bound, best_move, self.generation)
+        self.stores += 1
+        deep, recent = self.slots[index], self.slots[index + 1]
+        if recent is not None and recent[0] == key:
+            recent = self.slots[index + 1] = None
+        if deep is None or deep[0] == key or depth >= deep[1] or deep[5] != self.generation:
+            self.slots[index] = entry
+            if deep is not None and deep[0] != key:
+                # the previous depth-preferred entry still gets a second chance in the other slot
+                if recent is not None:
+                    self.overwrites += 1
+                self.slots[index + 1] = deep
+        else:
+            if recent is not None:
+                self.overwrites += 1
+            self.slots[index + 1] = entry
+
+    def peek(self, key):
+        """ Like probe, but without counting a hit or miss. """
+        index = 2 * (key & self.mask)
+        for entry in (self.slots[index], self.slots[index + 1]):
+            if entry is not None and entry[0] == key:
+                return entry
+        return None
+
+    def new_search(self):
+        """ Marks existing entries as old, so that deep results from earlier moves can be replaced. """
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * (2 * self.size)
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {'buckets': self.size,
+                'filled': sum(entry is not None for entry in self.slots),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / probes if probes else 0.0,
+                'stores': self.stores,
+                'overwrites': self.overwrites}
+
+
+class SearchTimeout(Exception):
+    """ Raised inside the search when make_move's deadline has passed. """
+
 
 class TeekoPlayer:
     """ An object representation for an AI game player for the game Teeko.
     """
-    board = [[' ' for j in range(5)] for i in range(5)]
     pieces = ['b', 'r']
-    DEPTH_LIMIT = 3  # Example default value, adjust based on timing tests
-
-    def __init__(self):
+    DEPTH_LIMIT = 3  # depth of a single max_value/min_value search; make_move raises it one iteration at a time
+    TIME_BUDGET = 4.0  # default seconds per make_move, under the 5 second limit per move
+    MAX_DEPTH = 64  # deepest iteration make_move will try when there is time left
+    CLOCK_INTERVAL = 128  # nodes between looks at the clock, a power of two; at ~15k nodes/s about 9 ms
+    SYMMETRY_PIECES = 6  # below this many pieces on the board, mirror-image successors are searched only once
+    THREAT_DEPTH = 3  # our moves in the forced win search make_move runs before the main search
+    PONDER_REPLIES = 3  # opponent replies searched in the background after each move when pondering
+    # PVS settings, chosen for the fewest nodes on the bench.py corpus (each board with either color to move) at
+    # depths 5 to 7: about 6% fewer nodes than plain alpha-beta at depth 5 and 12% at depth 6. Some boards need a
+    # few percent more, the third test_heuristics board among them. Check with bench.py, which runs test_pvs_nodes.
+    ASPIRATION_WINDOW = 0.3  # half-width of the first aspiration window (values are in [-1, 1])
+    PVS_MIN_REMAINING = 2  # plies that must remain below a node for its later moves to get null window searches
+
+    def __init__(self, tt_bytes=16 * 1024 * 1024, opening_book=None, tablebase=None, workers=1, batch_leaves=False,
+                 weights=None, profiler=None, ponder=False, position_cache=None, mcts=None, pvs=True):
         """ Initializes a TeekoPlayer object by randomly selecting red or black as its
         piece color.
+
+        Args:
+            tt_bytes (int): memory cap for the transposition table, which is kept
+                for the lifetime of the player so later moves reuse earlier searches.
+            opening_book (OpeningBook): optional precomputed drop phase moves (see
+                opening_book.py), played instead of searching whenever they cover the position.
+            tablebase (Tablebase): optional solved move phase table (see tablebase.py);
+                with it every move phase move is perfect and needs no search.
+            workers (int): number of processes searching root moves in parallel; 1
+                searches in this process only. The workers use this player's weights,
+                batch_leaves, pvs and position cache. Call close() to stop the worker pool.
+            batch_leaves (bool): evaluate the last ply of the search in NumPy batches,
+                one per node above the depth limit (needs numpy, see batch_eval.py).
+            weights (dict): heuristic weights overriding DEFAULT_WEIGHTS, any of 'two',
+                'three', 'center' and 'mobility' (see PATTERN HEURISTIC).
+            profiler (SearchProfiler): optional instrumentation counting and timing
+                the search (see profiler.py); without one the search runs uninstrumented.
+            ponder (bool): keep searching on the opponent's time (see start_pondering).
+                Call close() to stop the background search.
+            position_cache (PositionCache): optional persistent cache of deep search results
+                (see position_cache.py), shared with other processes and later runs. It
+                must have been created with the same heuristic weights.
+            mcts (MCTSSearch): optional Monte Carlo tree search (see mcts.py) that chooses the
+                moves instead of the minimax search; pondering only applies to the latter.
+                close() also stops its worker pool.
+            pvs (bool): principal variation search with aspiration windows (see max_node and
+                aspiration_search); False searches every move with the full window, which finds the
+                same values and is there to compare node counts against.
         """
+        # each player keeps its own board, so that one process can host any number of games
+        self.board = [[' ' for j in range(5)] for i in range(5)]
         self.my_piece = random.choice(self.pieces)
         self.opp = self.pieces[0] if self.my_piece == self.pieces[1] else self.pieces[1]
-
-    def make_move(self, state):
+        # search bookkeeping: node/cutoff counters, killer moves per depth, the history table and the transposition table
+        self.history = ({}, {})
+        self.tt = TranspositionTable(tt_bytes)
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        # pattern values indexed by the moving side's count * 5 + the other side's count, from our point of view,
+        # and how much they change when the moving side adds a piece to the pattern or removes one from it
+        values = pattern_value_table(self.weights)
+        self.pattern_values = (values, tuple(values[theirs * 5 + mine] for mine in range(5) for theirs in range(5)))
+        self.pattern_gains = tuple(tuple(table[index + 5] - table[index] if index < 20 else 0.0 for index in range(25))
+                                   for table in self.pattern_values)
+        self.pattern_losses = tuple(tuple(table[index - 5] - table[index] if index >= 5 else 0.0 for index in range(25))
+                                    for table in self.pattern_values)
+        self.square_values = (tuple(self.weights['center'] * centrality for centrality in SQUARE_CENTRALITY),
+                              tuple(-self.weights['center'] * centrality for centrality in SQUARE_CENTRALITY))
+        self.opening_book = opening_book
+        self.tablebase = tablebase
+        if position_cache is not None and position_cache.weights != self.weights:
+            raise ValueError("the position cache was filled with different heuristic weights")
+        self.position_cache = position_cache
+        self.mcts = mcts
+        self.workers = workers
+        self.batch_leaves = batch_leaves
+        self.pvs = pvs
+        if batch_leaves:
+            import batch_eval
+            self.batch_eval = batch_eval
+            self.batch_tables = batch_eval.heuristic_tables(self.weights)
+        self.pool = None
+        self.shared_alpha = None
+        self.pv = []
+        self.last_search = None
+        self.new_search()
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self)
+        # pondering: the background search thread, the positions it has searched and the one it is searching,
+        # the position the opponent actually moved to once known, and the flag that stops a search early
+        self.ponder = ponder
+        self.ponder_thread = None
+        self.ponder_lock = threading.Lock()
+        self.ponder_results = {}
+        self.pondering = None
+        self.ponder_actual = None
+        self.ponder_stopped = False
+        self.stop_search = False
+
+    def make_move(self, state, time_budget=None, max_depth=None):
         """ Selects a (row, col) space for the next move. You may assume that whenever
         this function is called, it is this player's turn to move.
 
+        Drop phase positions covered by the opening book, and move phase positions when
+        a tablebase is loaded, are answered from them directly, and so are positions with
+        an immediate win, a single move that stops the opponent's win, or a forced win
+        by a sequence of threats.
+        Otherwise the move is chosen by iterative deepening: alpha-beta searches of depth 1, 2,
+        3, ... are run until the time budget runs out, and the best move of the
+        deepest search that finished is played. Each search tries the previous
+        search's principal variation first, and the transposition table carries
+        everything else over, so the repeated shallow searches cost little. With
+        pvs (the default) the other moves are only searched with a null window,
+        and the root with an aspiration window around an earlier iteration's value.
+
+        When pondering, the search picks up where the background search of this
+        position left off (if the opponent played one of the replies it searched)
+        and counts the time already spent on it against the budget.
+
         Args:
             state (list of lists): should be the current state of the game as saved in
                 this TeekoPlayer object. Note that this is NOT assumed to be a copy of
@@ -29,6 +743,10 @@ class TeekoPlayer:
 
                 In the "drop phase", the state will contain less than 8 elements which
                 are not ' ' (a single space character).
+            time_budget (float): wall-clock seconds the search may use, defaults to
+                TIME_BUDGET. The deadline is checked inside the search, so the call
+                returns shortly after it even in the middle of an iteration.
+            max_depth (int): deepest iteration to run, defaults to MAX_DEPTH.
 
         Return:
             move (list): a list of move tuples such that its format is
@@ -37,174 +755,883 @@ class TeekoPlayer:
                 optional (source_row, source_col) tuple contains the location of the
                 piece the AI plans to relocate (for moves after the drop phase). In
                 the drop phase, this list should contain ONLY THE FIRST tuple.
-
-        Note that without drop phase behavior, the AI will just keep placing new markers
-            and will eventually take over the board. This is not a valid strategy and
-            will earn you no points.
         """
+        mine, theirs = self.encode(state)
+        pondered = self.stop_pondering(mine, theirs)
+        move = self.choose_move(mine, theirs, time_budget, max_depth, pondered)
+        if self.ponder and self.mcts is None:
+            self.start_pondering(mine, theirs, move, time_budget, max_depth)
+        return self.decode_move(mine, move)
+
+    #make_move on bitboards: the bits our best move flips, for (mine, theirs) with us to move.
+    #pondered is the summary of an earlier search of this position for iterative_deepening to resume.
+    def choose_move(self, mine, theirs, time_budget=None, max_depth=None, pondered=None):
+        move = self.book_move(mine, theirs)
+        if move is None:
+            move = self.tablebase_move(mine, theirs)
+        if move is None:
+            move = self.threat_move(mine, theirs)
+        if move is None and self.mcts is not None:
+            move = self.mcts_move(mine, theirs, time_budget)
+        if move is None:
+            move = self.iterative_deepening(mine, theirs, time_budget, max_depth, pondered)
+        return move
 
-        # players take turns placing their markers on the board. The goal is to set up for a winning position. This phase continues
-        # until all eight markers (four from each player) are placed on the board. Players must strategically place their markers,
-        # considering both offensive moves (to create a winning line or box) and defensive moves (to block the opponent).
+    #The Monte Carlo tree search's move, for players that use it; max_depth means nothing to it.
+    def mcts_move(self, mine, theirs, time_budget=None):
+        move = self.mcts.search(mine, theirs, self.TIME_BUDGET if time_budget is None else time_budget)
+        self.last_search = self.mcts.last_search
+        return move
 
+    # Pondering
+
+    # After our move the opponent takes its time to reply, and a pondering player searches meanwhile in a
+    # background thread: first the position after the reply our principal variation predicts, then those after
+    # the opponent's other most promising replies, each for up to a move's time budget. What each search reached
+    # is kept in self.ponder_results, and everything it found stays in the transposition table. Once
+    # opponent_move tells which reply was played, searches of the other replies are cancelled and the search
+    # of the actual one goes on until make_move, which stops it and resumes from the deepest iteration it
+    # completed (see iterative_deepening). The background thread and the main thread never search at the same
+    # time: the main thread only touches the board until make_move has stopped the thread.
+
+    #Starts searching, in the background, the likely positions after the opponent's reply to our move from
+    #(mine, theirs). The reply our search expects comes from its principal variation, if the move came from it.
+    def start_pondering(self, mine, theirs, move, time_budget=None, max_depth=None):
+        self.ponder_results = {}
+        self.ponder_actual = None
+        self.ponder_stopped = False
+        self.stop_search = False
+        mine ^= move
+        if has_win(mine) or has_win(theirs):
+            return
+        pv = (self.last_search or {}).get('pv', [])
+        predicted = pv[1] if len(pv) > 1 and pv[0] == move else None
+        positions = [(mine, theirs ^ reply) for reply in self.likely_replies(mine, theirs, predicted)]
+        if not positions:
+            return
+        self.ponder_thread = threading.Thread(target=self.ponder_positions, args=(positions, time_budget, max_depth),
+                                              daemon=True)
+        self.ponder_thread.start()
+
+    #Up to PONDER_REPLIES of the opponent's replies, predicted first and then the best for the opponent by the
+    #heuristic. Replies that win on the spot end the game and need no search.
+    def likely_replies(self, mine, theirs, predicted=None):
+        self.set_position(mine, theirs, min_to_move=True)
+        replies = sorted(self.moves(THEIRS), key=lambda reply: self.child_value(THEIRS, reply))
+        replies = [reply for reply in replies if not has_win(theirs ^ reply)]
+        if predicted in replies:
+            replies.remove(predicted)
+            replies.insert(0, predicted)
+        return replies[:self.PONDER_REPLIES]
+
+    #Body of the pondering thread.
+    def ponder_positions(self, positions, time_budget, max_depth):
+        saved_search = self.last_search
+        for position in positions:
+            with self.ponder_lock:
+                if self.ponder_stopped:
+                    break
+                if self.ponder_actual is not None and position != self.ponder_actual:
+                    continue
+                self.pondering = position
+                self.stop_search = False
+            self.iterative_deepening(*position, time_budget, max_depth)
+            search = self.last_search
+            if search['depth']:
+                self.ponder_results[position] = {name: search[name] for name in ('depth', 'value', 'move', 'pv', 'time')}
+        with self.ponder_lock:
+            self.pondering = None
+        self.last_search = saved_search
+
+    #Called by opponent_move with the position after the opponent's actual reply: cancels the search of any
+    #other reply, and lets the search of this one (if it was predicted) continue.
+    def ponder_reply(self, mine, theirs):
+        with self.ponder_lock:
+            self.ponder_actual = (mine, theirs)
+            if self.pondering != self.ponder_actual:
+                self.stop_search = True
+
+    #Stops the pondering thread and returns what it found for (mine, theirs), or None.
+    def stop_pondering(self, mine, theirs):
+        if self.ponder_thread is None:
+            return None
+        with self.ponder_lock:
+            self.ponder_stopped = True
+            self.stop_search = True
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.stop_search = False
+        return self.ponder_results.get((mine, theirs))
+
+    #The opening book's move for a drop phase position, or None if there is no book or it doesn't cover the position.
+    def book_move(self, mine, theirs):
+        if self.opening_book is None or (mine | theirs).bit_count() >= 8:
+            return None
+        move = self.opening_book.lookup(mine, theirs)
+        if move is None or move & (mine | theirs):
+            return None
+        self.last_search = {'book': True, 'move': move}
+        return move
 
-        drop_phase = True   # TODO: detect drop phase
+    #The tablebase's perfect move for a move phase position, or None if there is no tablebase or it's the drop phase.
+    #Among equally good moves (e.g. all the drawing ones) the heuristic picks the one that keeps the most pressure on.
+    def tablebase_move(self, mine, theirs):
+        if self.tablebase is None or mine.bit_count() != 4 or theirs.bit_count() != 4:
+            return None
+        move = self.tablebase.best_move(mine, theirs, lambda child: self.heuristic_bits(child, theirs))
+        self.last_search = {'tablebase': True, 'move': move, 'result': self.tablebase.probe(mine, theirs)}
+        return move
 
+    #Answers clear tactical positions without the main search (see THREATS): a win on the spot, the only move
+    #that stops the opponent's win, or a forced win found by threat space search within THREAT_DEPTH of our moves.
+    def threat_move(self, mine, theirs):
+        wins = winning_moves(mine, theirs)
+        blocks = None if wins else blocking_moves(mine, theirs)
+        if wins:
+            move, reason = wins[0], 'win'
+        elif blocks is not None and len(blocks) == 1:
+            move, reason = blocks[0], 'forced block'
+        else:
+            move, reason = forced_win(mine, theirs, self.THREAT_DEPTH), 'forced win'
+        if move is None:
+            return None
+        self.last_search = {'threats': reason, 'move': move}
+        return move
 
-        if not drop_phase:
-            # TODO: choose a piece to move and remove it from the board
-            # (You may move this condition anywhere, just be sure to handle it)
-            #
-            # Until this part is implemented and the move list is updated
-            # accordingly, the AI will not follow the rules after the drop phase!
-            pass
+    #Runs deeper and deeper searches from (mine, theirs) until the deadline, a proven win or loss, or max_depth.
+    #The depth 1 search always runs to completion so there is a move to return however small the budget.
+    #Returns the move bits of the best move from the deepest completed iteration and leaves a summary in self.last_search.
+    #resume is the summary of an earlier search of the same position (from pondering, or else from the position
+    #cache): its iterations are not searched again, and its time counts against the budget.
+    def iterative_deepening(self, mine, theirs, time_budget=None, max_depth=None, resume=None):
+        if time_budget is None:
+            time_budget = self.TIME_BUDGET
+        if max_depth is None:
+            max_depth = self.MAX_DEPTH
+        if next(generate_moves(mine, theirs), None) is None:
+            raise Exception("No legal moves")
+
+        start = time.perf_counter()
+        self.new_search()
+        self.pv = []
+        search_root = self.parallel_search_root if self.workers > 1 else self.search_root
+        best_move, best_value, completed = None, 0, 0
+        if resume is None and self.position_cache is not None:
+            resume = self.cached_search(mine, theirs)
+        if resume is not None:
+            best_move, best_value, completed = resume['move'], resume['value'], resume['depth']
+            self.pv = resume['pv']
+            time_budget -= resume['time']
+            if best_value in (1, -1):
+                max_depth = completed
+        # (depth, nodes searched by the iteration, seconds since the start) for every completed iteration
+        iterations = []
+        # the value of every completed iteration by depth: the aspiration windows are centered on the value from two
+        # iterations back, which ended on the same side's move, since the values swing between odd and even depths
+        values = {completed: best_value} if completed else {}
+        for depth in range(completed + 1, max_depth + 1):
+            self.DEPTH_LIMIT = depth
+            self.deadline = start + time_budget if best_move is not None else math.inf
+            nodes_before = self.stats['nodes']
+            try:
+                if self.pvs and self.workers == 1 and completed and best_value not in (1, -1):
+                    guess = values.get(depth - 2, best_value)
+                    best_value, best_move = self.aspiration_search(mine, theirs, best_move, guess)
+                else:
+                    best_value, best_move = search_root(mine, theirs, best_move)
+            except SearchTimeout:
+                break
+            completed = depth
+            iterations.append((depth, self.stats['nodes'] - nodes_before, time.perf_counter() - start))
+            values[depth] = best_value
+            self.pv = self.principal_variation(mine, theirs, depth)
+            if best_value in (1, -1):
+                break
+        self.deadline = math.inf
+
+        self.last_search = {'depth': completed, 'value': best_value, 'move': best_move, 'pv': self.pv,
+                            'time': time.perf_counter() - start, 'iterations': iterations, **self.stats}
+        if resume is not None:
+            self.last_search['resumed'] = resume
+        if self.workers > 1:
+            self.last_search['worker_nodes'] = dict(self.worker_nodes)
+        return best_move
+
+    #Searches every move at the root with the current DEPTH_LIMIT, starting with first_move (the best move of the
+    #previous iteration). Returns (value, move bits); the result is stored in the transposition table, as exact
+    #if it lies inside the (alpha, beta) window and as a bound if the search failed low or high.
+    #With pvs, moves after the first are searched with a null window above the best value so far (see max_node).
+    def search_root(self, mine, theirs, first_move=None, alpha=-math.inf, beta=math.inf):
+        self.set_position(mine, theirs)
+        self.stats['nodes'] += 1
+        key = self.key
+        best_value, best_move = -math.inf, None
+        for move in self.ordered_moves(MINE, 0, first_move, True):
+            floor = max(alpha, best_value)
+            self.do_move(MINE, move)
+            if best_move is not None and self.pvs and self.DEPTH_LIMIT >= self.PVS_MIN_REMAINING:
+                value = self.min_node(1, floor, math.nextafter(floor, math.inf))
+                if floor < value < beta:
+                    self.stats['researches'] += 1
+                    value = self.min_node(1, floor, beta)
+            else:
+                value = self.min_node(1, floor, beta)
+            self.undo_move(MINE, move)
+            if value > best_value:
+                best_value, best_move = value, move
+            if best_value >= beta:
+                break
+        bound = UPPER_BOUND if best_value <= alpha else LOWER_BOUND if best_value >= beta else EXACT
+        self.tt.store(key, self.DEPTH_LIMIT, best_value, bound, best_move)
+        if self.position_cache is not None:
+            self.store_position_cache(MINE, self.DEPTH_LIMIT, best_value, bound, best_move)
+        return best_value, best_move
+
+    #One iteration of iterative deepening with pvs: the root is first searched with a narrow window around guess,
+    #an earlier iteration's value, which prunes more than the full window when the value moves little from one
+    #depth to the next. A value outside the window is only a bound, so the window is widened on that side, four
+    #times as far each time, until the value falls inside it. Returns (value, move bits) like search_root.
+    def aspiration_search(self, mine, theirs, first_move, guess):
+        delta = self.ASPIRATION_WINDOW
+        alpha, beta = guess - delta, guess + delta
+        while True:
+            # the value never leaves [-1, 1], so a window reaching past either end is open on that side
+            if alpha <= -1:
+                alpha = -math.inf
+            if beta >= 1:
+                beta = math.inf
+            value, move = self.search_root(mine, theirs, first_move, alpha, beta)
+            if alpha < value < beta:
+                return value, move
+            self.stats['researches'] += 1
+            delta *= 4
+            if value <= alpha:
+                alpha = value - delta
+            else:
+                beta, first_move = value + delta, move
+
+    #search_root spread over a pool of worker processes (Young Brothers Wait): the first move, usually the previous
+    #iteration's best, is searched here to get a good alpha, then the remaining root moves are searched by the workers.
+    #The best value so far is shared through self.shared_alpha, so workers starting later search with a narrower
+    #window and prune more. Each worker keeps its own transposition table between tasks and moves.
+    #Node counts per process id are accumulated in self.worker_nodes.
+    def parallel_search_root(self, mine, theirs, first_move=None):
+        if self.pool is None:
+            self.shared_alpha = multiprocessing.Value('d', -math.inf)
+            # the workers search with this player's configuration: same weights, leaf batching, pvs and position cache
+            cache = self.position_cache
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_search_worker,
+                                            initargs=(self.shared_alpha, self.tt.size * 2 * TranspositionTable.ENTRY_BYTES,
+                                                      self.weights, self.batch_leaves, self.pvs,
+                                                      None if cache is None else cache.path,
+                                                      cache is not None and cache.readonly))
+        self.set_position(mine, theirs)
+        self.stats['nodes'] += 1
+        ordered = list(self.ordered_moves(MINE, 0, first_move, True))
+
+        nodes_before = self.stats['nodes']
+        self.do_move(MINE, ordered[0])
+        best_value = self.min_node(1, -math.inf, math.inf)
+        self.undo_move(MINE, ordered[0])
+        best_move = ordered[0]
+        self.count_worker_nodes(os.getpid(), self.stats['nodes'] - nodes_before)
+        self.shared_alpha.value = best_value
+
+        # workers can't see this process's clock, so the deadline is passed as wall-clock time
+        deadline = time.time() + (self.deadline - time.perf_counter()) if self.deadline != math.inf else math.inf
+        futures = [(move, self.pool.submit(_search_root_child, mine ^ move, theirs, self.DEPTH_LIMIT, deadline))
+                   for move in ordered[1:]]
+        timed_out = False
+        for move, future in futures:
+            value, nodes, worker = future.result()
+            self.stats['nodes'] += nodes
+            self.count_worker_nodes(worker, nodes)
+            if value is None:
+                timed_out = True
+            elif value > best_value:
+                best_value, best_move = value, move
+        if timed_out:
+            raise SearchTimeout()
+        self.tt.store(zobrist_hash(mine, theirs), self.DEPTH_LIMIT, best_value, EXACT, best_move)
+        if self.position_cache is not None:
+            self.store_position_cache(MINE, self.DEPTH_LIMIT, best_value, EXACT, best_move)
+        return best_value, best_move
+
+    def count_worker_nodes(self, worker, nodes):
+        self.worker_nodes[worker] = self.worker_nodes.get(worker, 0) + nodes
+
+    #Stops pondering and shuts down the worker processes of a parallel player.
+    def close(self):
+        self.stop_pondering(None, None)
+        if self.mcts is not None:
+            self.mcts.close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    #Follows the best moves stored in the transposition table from the root, giving the expected line of play
+    #(as move bits, one per ply) that the next iteration searches first.
+    def principal_variation(self, mine, theirs, depth):
+        pv = []
+        self.set_position(mine, theirs)
+        while len(pv) < depth and not (self.won[MINE] or self.won[THEIRS]):
+            # we move on even plies, the opponent on odd ones
+            side = len(pv) % 2
+            entry = self.tt.peek(self.key)
+            if entry is None or entry[4] is None or not self.is_legal(side, entry[4]):
+                break
+            pv.append(entry[4])
+            self.do_move(side, entry[4])
+        return pv
 
-        # select an unoccupied space randomly
-        # TODO: implement a minimax algorithm to play better
-        move = []
-        (row, col) = (random.randint(0,4), random.randint(0,4))
-        while not state[row][col] == ' ':
-            (row, col) = (random.randint(0,4), random.randint(0,4))
+    #Turns the bits flipped by one of our moves into the [(row, col), (source_row, source_col)] format.
+    def decode_move(self, mine, move):
+        return decode_move(mine, move)
 
-        # ensure the destination (row,col) tuple is at the beginning of the move list
-        move.insert(0, (row, col))
-        return move
-    
 
-    #helper function for succ
     #Iterate over the board and count the number of pieces for each player.
     def count_pieces(self, state):
         count_r = sum(row.count('r') for row in state)
         count_b = sum(row.count('b') for row in state)
         return count_r, count_b
 
-    
-    # FUNCTION: succ(self,state)
-    # INPUT: board state
+
+    # FUNCTION: succ(self,state,piece)
+    # INPUT: board state and the piece of the side to move (this player's piece by default)
     # RETURN: List of legal states. During the drop phase, this simply means
-    # adding a new piece of the current player's type to the board; during continued gameplay, this means moving any one of the current player's pieces to an unoccupied location on the board, adjacent to that piece.
-    def succ(self, state):
-        successors = []
+    # adding a new piece of the moving side's type to the board; during continued gameplay, this means moving any one of that side's pieces to an unoccupied location on the board, adjacent to that piece.
+    # The phase is decided per side from its piece count (count_pieces): a side drops until it has 4 pieces on the board.
+    # Kept for callers that want whole boards; the search itself uses generate_moves with do_move/undo_move.
+    # The moves are listed from the flat board with the geometry tables, in the same order as generate_moves,
+    # and each successor is a copy of state with the one or two changed cells set.
+    def succ(self, state, piece=None):
+        if piece is None:
+            piece = self.my_piece
         count_r, count_b = self.count_pieces(state)
-        #If both players have fewer than four pieces on the board, it's the drop phase. Otherwise, it's the move phase.
-        drop_phase = count_r < 4 or count_b < 4
-
-        #During the drop phase, add a new piece of the current player's type to the board
-        if drop_phase:
-            for i in range(5):
-                for j in range(5):
-                    if state[i][j] == ' ':
-                        new_state = [row[:] for row in state]
-                        new_state[i][j] = self.my_piece
-                        successors.append(new_state)
-
-        #Once all pieces are on the board, the function generates successors by moving each of the current player's pieces to every adjacent (horizontally, vertically, or diagonally) unoccupied space.
+        cells = list(chain.from_iterable(state))
+        if (count_r if piece == 'r' else count_b) < PIECES_PER_SIDE:
+            moves = [(square, None) for square, cell in enumerate(cells) if cell == ' ']
         else:
-            for i in range(5):
-                for j in range(5):
-                    if state[i][j] == self.my_piece:
-                        for di in [-1, 0, 1]:
-                            for dj in [-1, 0, 1]:
-                                if di == 0 and dj == 0:
-                                    continue  # Skip the current spot
-                                if 0 <= i+di < 5 and 0 <= j+dj < 5 and state[i+di][j+dj] == ' ':
-                                    new_state = [row[:] for row in state]
-                                    new_state[i][j] = ' '
-                                    new_state[i+di][j+dj] = self.my_piece
-                                    successors.append(new_state)
+            squares = [square for square, cell in enumerate(cells) if cell == piece]
+            moves = [(target, square) for square in squares for target in SQUARE_NEIGHBORS[square]
+                     if cells[target] == ' ']
+        successors = []
+        for target, source in moves:
+            child = [row[:] for row in state]
+            row, col = SQUARE_COORDS[target]
+            child[row][col] = piece
+            if source is not None:
+                row, col = SQUARE_COORDS[source]
+                child[row][col] = ' '
+            successors.append(child)
         return successors
-    
+
+    #Adapter from the list of lists format to the (my bits, opponent bits) pair used by the search.
+    def encode(self, state):
+        return encode_state(state, self.my_piece), encode_state(state, self.opp)
 
 
-    #HELPER FUNCTION FOR heuristic_game_value(self, state)
     #Check for three pieces of the specified type in a row (horizontal, vertical) or part of a 2x2 box. Returns a heuristic score.
+    #This was the heuristic before the open pattern counts below replaced it.
     def check_three_in_a_row(self, state, piece):
-
-        heuristic_val = 0.0
-
-        # Iterates over each row and column to check for three consecutive pieces of type piece horizontally. If found, adds 0.5 to heuristic_val.
-        for row in range(5):
-            for col in range(3):
-                if state[row][col:col+3] == [piece] * 3:
-                    heuristic_val += 0.5
-
-        #Checks for vertical patterns of three consecutive pieces of type piece. Adds 0.5 to heuristic_val if such a pattern is found.
-        for col in range(5):
-            for row in range(3):
-                if state[row][col] == state[row+1][col] == state[row+2][col] == piece:
-                    heuristic_val += 0.5
-
-        # Checks for 2x2 box patterns where three of the four positions are occupied by piece. Adds 0.5 to heuristic_val for each such pattern.
-        for row in range(4):
-            for col in range(4):
-                if (state[row][col] == state[row+1][col] == state[row][col+1] == piece or
-                    state[row][col+1] == state[row+1][col+1] == state[row+1][col] == piece):
-                    heuristic_val += 0.5
-
-        return heuristic_val
+        return three_pattern_score(encode_state(state, piece))
 
     # FUNCTION: heuristic_game_value(self,state)- Evalutes non-terminal states
     # OUTPUT: provides an overall heuristic score for the current state by evaluating
     #         specific advantageous or disadvantageous patterns for both the AI player and the opponent.
     def heuristic_game_value(self, state):
+        return self.heuristic_bits(*self.encode(state))
 
-        #Call the game_value method to check if the current state is a terminal state
-        terminal_value = self.game_value(state)
-        #If terminal_value is 1 or -1 (indicating a win or lose state), then return this value immediately, as no heuristic evaluation is needed for terminal states.
-        if terminal_value == 1 or terminal_value == -1:
-            return terminal_value
-
-        #In Teeko, winning conditions include getting four pieces in a row or forming a 2x2 box, so having three aligned pieces is just one step away from winning.
-
-        # Initialize heuristic score
-        score = 0.0
-        
-        #Calls check_three_in_a_row for both the AI's pieces (self.my_piece) and the opponent's pieces (self.opp).
-        #The function adds to the score for patterns favorable to the AI and subtracts for patterns favorable to the opponent.
-        score += self.check_three_in_a_row(state, self.my_piece)
-        score -= self.check_three_in_a_row(state, self.opp)
-
-        #Normalizes the score to ensure it remains within the range of -1 to 1.
-        score = max(min(score, 1), -1)
-
-        return score
-    
-    # Implementing Minimax
-
-    # max_value and min_value functions represents the decisions of the AI (Max) and the opponent (Min) respectively.
+    #Bitboard version of heuristic_game_value.
+    def heuristic_bits(self, mine, theirs):
 
-    # takes the current state of the game and the current depth of recursion as arguments.
-    def max_value(self, state, depth):
+        #If this is a win or lose state, return that value immediately, as no heuristic evaluation is needed for terminal states.
+        terminal_value = self.game_value_bits(mine, theirs)
+        if terminal_value != 0:
+            return terminal_value
+        return self.pattern_score(mine, theirs)
+
+    #The heuristic for a position already known not to be won by either side, computed from scratch.
+    #Each winning pattern only one side has pieces in counts for that side (more the fuller it is), each piece
+    #counts by how central its square is, and in the move phase each extra legal move counts too.
+    def pattern_score(self, mine, theirs):
+        score = raw_pattern_score(mine, theirs, self.pattern_values[MINE], self.weights['center'])
+        return self.squash(score + self.mobility_score(mine, theirs))
+
+    #The same for the search position, from the pattern counts do_move keeps up to date.
+    def leaf_value(self):
+        score = self.score
+        if self.piece_counts[MINE] + self.piece_counts[THEIRS] == 2 * PIECES_PER_SIDE and self.weights['mobility']:
+            score += self.mobility_score(*self.position)
+        return score / (abs(score) + HEURISTIC_SCALE)
+
+    def mobility_score(self, mine, theirs):
+        if not self.weights['mobility'] or mine.bit_count() + theirs.bit_count() < 2 * PIECES_PER_SIDE:
+            return 0.0
+        return self.weights['mobility'] * (mobility(mine, theirs) - mobility(theirs, mine))
+
+    #Maps a raw score into (-1, 1), keeping its order, so that it stays below a win and above a loss.
+    def squash(self, score):
+        return score / (abs(score) + HEURISTIC_SCALE)
+
+    # Incremental make/unmake
+
+    # The search keeps one position on the player and changes it in place: do_move flips a move's bits and
+    # updates the piece counts, the Zobrist key, each side's piece count in every winning pattern, the heuristic
+    # score that follows from those counts, and whether the mover has won (one of its patterns reaching 4).
+    # Only the patterns through the one or two squares a move changes are touched. undo_move reverts exactly
+    # that. Sides are MINE (0) and THEIRS (1), indexes into self.position, self.piece_counts, self.pattern_counts
+    # and self.won.
+
+    def set_position(self, mine, theirs, min_to_move=False):
+        self.position = [mine, theirs]
+        self.piece_counts = [mine.bit_count(), theirs.bit_count()]
+        self.pattern_counts = [pattern_counts(mine), pattern_counts(theirs)]
+        # our open pattern and centrality score, before squashing (see leaf_value)
+        self.score = raw_pattern_score(mine, theirs, self.pattern_values[MINE], self.weights['center'])
+        # per side, the number of patterns it holds 3 squares of while the other side holds none (see THREATS)
+        self.threats = [sum(1 for mask in WIN_MASKS if (mine & mask).bit_count() == 3 and not theirs & mask),
+                        sum(1 for mask in WIN_MASKS if (theirs & mask).bit_count() == 3 and not mine & mask)]
+        self.score_stack = []
+        self.pattern_stack = []
+        self.won = [has_win(mine), has_win(theirs)]
+        self.won_stack = []
+        self.key = zobrist_hash(mine, theirs, min_to_move)
+
+    #Plays move (the bits it flips) for side on the search position.
+    def do_move(self, side, move):
+        bits = self.position[side] ^ move
+        self.position[side] = bits
+        self.key ^= zobrist_delta(move, side) ^ ZOBRIST_MIN_TO_MOVE
+        self.score_stack.append((self.score, self.threats))
+        self.threats = self.threats[:]
+        self.won_stack.append(self.won[side])
+        # the counts are copied rather than changed in place, which makes undoing them free
+        self.pattern_stack.append(self.pattern_counts[side])
+        self.pattern_counts[side] = self.pattern_counts[side][:]
+        destination = move & bits
+        source = move ^ destination
+        if source:
+            self.remove_piece(side, source.bit_length() - 1)
+        else:
+            self.piece_counts[side] += 1
+        completed = self.add_piece(side, destination.bit_length() - 1)
+        if self.won[side]:
+            # only possible when moving on from a finished game; the moved piece may have broken the win
+            self.won[side] = completed or has_win(bits)
+        else:
+            self.won[side] = completed
+
+    #Adds one of side's pieces on square to the pattern counts, the score and the threat counts.
+    #Returns True if that completed one of side's patterns (its count was already 3).
+    #index is side's count * 5 + the other side's count before the change.
+    def add_piece(self, side, square):
+        counts, other_counts = self.pattern_counts[side], self.pattern_counts[1 - side]
+        gains = self.pattern_gains[side]
+        threats = self.threats
+        score = self.score + self.square_values[side][square]
+        completed = False
+        for pattern in SQUARE_PATTERNS[square]:
+            index = counts[pattern] * 5 + other_counts[pattern]
+            score += gains[index]
+            counts[pattern] += 1
+            if index == 10:
+                threats[side] += 1
+            elif index == 3:
+                threats[1 - side] -= 1
+            elif index >= 15:
+                threats[side] -= 1
+                completed = True
+        self.score = score
+        return completed
+
+    def remove_piece(self, side, square):
+        counts, other_counts = self.pattern_counts[side], self.pattern_counts[1 - side]
+        losses = self.pattern_losses[side]
+        threats = self.threats
+        score = self.score - self.square_values[side][square]
+        for pattern in SQUARE_PATTERNS[square]:
+            index = counts[pattern] * 5 + other_counts[pattern]
+            score += losses[index]
+            counts[pattern] -= 1
+            if index == 15:
+                threats[side] -= 1
+            elif index == 8:
+                threats[1 - side] += 1
+            elif index == 20:
+                threats[side] += 1
+        self.score = score
+
+    #Takes back move for side, which must be the last move played.
+    def undo_move(self, side, move):
+        bits = self.position[side] ^ move
+        self.position[side] = bits
+        self.key ^= zobrist_delta(move, side) ^ ZOBRIST_MIN_TO_MOVE
+        self.pattern_counts[side] = self.pattern_stack.pop()
+        if move & bits == 0:
+            self.piece_counts[side] -= 1
+        self.score, self.threats = self.score_stack.pop()
+        self.won[side] = self.won_stack.pop()
+
+    #Lazily yields side's legal moves on the search position.
+    def moves(self, side):
+        return generate_moves(self.position[side], self.position[1 - side], self.piece_counts[side] < PIECES_PER_SIDE)
+
+    #Whether move is legal for side on the search position, used to check moves taken from the transposition
+    #table (a different position with the same hash could have stored it) before playing them.
+    def is_legal(self, side, move):
+        mover, other = self.position[side], self.position[1 - side]
+        empty = FULL_BOARD & ~(mover | other)
+        if self.piece_counts[side] < PIECES_PER_SIDE:
+            return move & (move - 1) == 0 and bool(move & empty)
+        source, destination = move & mover, move & empty
+        return (source.bit_count() == 1 and destination.bit_count() == 1 and move == source | destination and
+                bool(NEIGHBOR_MASKS[source.bit_length() - 1] & destination))
+
+    # Implementing Minimax with alpha-beta pruning
+
+    # max_value and min_value functions represents the decisions of the AI (Max) and the opponent (Min) respectively:
+    # max nodes play the AI's moves (MINE) and min nodes the opponent's (THEIRS).
+    # alpha is the best score Max can already guarantee on the path to the root and beta the best score Min can;
+    # once a node's value falls outside (alpha, beta) the remaining children cannot change the result and are skipped.
+
+    # takes the current state of the game, the current depth of recursion and the alpha-beta window as arguments.
+    def max_value(self, state, depth, alpha=-math.inf, beta=math.inf):
+        return self.max_value_bits(*self.encode(state), depth, alpha, beta)
+
+    def min_value(self, state, depth, alpha=-math.inf, beta=math.inf):
+        return self.min_value_bits(*self.encode(state), depth, alpha, beta)
+
+    #The same on bitboards: these load the position into the search and then run max_node/min_node on it.
+    def max_value_bits(self, mine, theirs, depth, alpha=-math.inf, beta=math.inf):
+        self.set_position(mine, theirs)
+        return self.max_node(depth, alpha, beta)
+
+    def min_value_bits(self, mine, theirs, depth, alpha=-math.inf, beta=math.inf):
+        self.set_position(mine, theirs, min_to_move=True)
+        return self.min_node(depth, alpha, beta)
+
+    def max_node(self, depth, alpha, beta):
+        self.stats['nodes'] += 1
+        self.check_deadline()
 
         #If the current state is a terminal state or if the depth limit has been reached, the function returns the game value of the state.
-        if self.game_value(state) == 1 or self.game_value(state) == -1:
-            return self.game_value(state)
-        
+        if self.won[MINE]:
+            return 1
+        if self.won[THEIRS]:
+            return -1
+
         #When the depth limit is reached in the max_value function (and the state is not a terminal state), you should return the heuristic value of the state
         elif depth == self.DEPTH_LIMIT:
-            return self.heuristic_game_value(state)
-        
-        #Initialize alpha to negative infinity. alpha will hold the best score found so far for the maximizing player (AI).
-        alpha = -math.inf
-
-        #Iterates over all possible successor states from the current state. 
-        for successor in self.succ(state):
-            # for each successor, it calls the min_value function (representing the opponent's best move in response)
-            # updates alpha with the maximum value between the current alpha and the value returned from min_value.
-            alpha = max(alpha, self.min_value(successor, depth + 1))
+            self.stats['leaves'] += 1
+            return self.leaf_value()
+
+        #A side that can complete a pattern on this move wins (see THREATS), whatever else it could play.
+        if self.threats[MINE] and self.can_win_now(MINE):
+            return 1
+
+        #Look the position up in the transposition table. A result searched at least as deep either answers
+        #this node outright or narrows the window; either way its best move is tried first.
+        key = self.key
+        alpha_orig, beta_orig = alpha, beta
+        remaining = self.DEPTH_LIMIT - depth
+        hash_move, cached = self.probe_tt(key, remaining, alpha, beta, MINE)
+        if cached is not None:
+            if cached[0] == EXACT:
+                return cached[1]
+            alpha, beta = cached[1], cached[2]
+            if alpha >= beta:
+                return cached[3]
+
+        #Facing a win on the opponent's next move only the moves that block it are worth searching; with none
+        #the game is lost. Both are exact once the opponent's win is within the depth limit.
+        forced = self.forced_moves(MINE) if remaining > 1 else None
+        if forced == []:
+            return -1
+
+        if self.batch_leaves and depth + 1 == self.DEPTH_LIMIT:
+            value, best_move = self.evaluate_frontier(MINE, True)
+            if best_move is not None:
+                self.store_tt(key, remaining, value, -math.inf, math.inf, best_move, MINE)
+                return value
+
+        #value will hold the best score found so far for the maximizing player (AI).
+        value = -math.inf
+        best_move = None
+
+        #Plays the moves one at a time, most promising first, so that cutoffs happen as early as possible.
+        moves = forced if forced is not None else self.ordered_moves(MINE, depth, hash_move, True)
+        #With pvs, the first move is assumed best and searched with the full window; the others are only asked
+        #whether they beat it, with a null window that cuts off far sooner, and searched again fully if they do.
+        #Only nodes with at least PVS_MIN_REMAINING plies below them do this.
+        for move in moves:
+            # for each move, it calls the min_value function (representing the opponent's best move in response)
+            self.do_move(MINE, move)
+            if best_move is not None and self.pvs and remaining >= self.PVS_MIN_REMAINING:
+                child_value = self.min_node(depth + 1, alpha, math.nextafter(alpha, math.inf))
+                if alpha < child_value < beta:
+                    self.stats['researches'] += 1
+                    child_value = self.min_node(depth + 1, alpha, beta)
+            else:
+                child_value = self.min_node(depth + 1, alpha, beta)
+            self.undo_move(MINE, move)
+            if child_value > value:
+                value, best_move = child_value, move
+            # Min already has a better option elsewhere, so it will never let the game reach this state.
+            if value >= beta:
+                self.record_cutoff(MINE, move, depth)
+                break
+            alpha = max(alpha, value)
 
         # Returns the best score that the maximizing player (AI) can achieve from this state.
-        return alpha
-    
-    def min_value(self, state, depth):
-        if self.game_value(state) != 0 or depth == self.DEPTH_LIMIT:
-            return self.game_value(state)
-        
-        beta = math.inf
-        for successor in self.succ(state):
-            beta = min(beta, self.max_value(successor, depth + 1))
-        return beta
-    
+        self.store_tt(key, remaining, value, alpha_orig, beta_orig, best_move, MINE)
+        return value
+
+    def min_node(self, depth, alpha, beta):
+        self.stats['nodes'] += 1
+        self.check_deadline()
+        if self.won[MINE]:
+            return 1
+        if self.won[THEIRS]:
+            return -1
+        elif depth == self.DEPTH_LIMIT:
+            self.stats['leaves'] += 1
+            return self.leaf_value()
+        if self.threats[THEIRS] and self.can_win_now(THEIRS):
+            return -1
+
+        key = self.key
+        alpha_orig, beta_orig = alpha, beta
+        remaining = self.DEPTH_LIMIT - depth
+        hash_move, cached = self.probe_tt(key, remaining, alpha, beta, THEIRS)
+        if cached is not None:
+            if cached[0] == EXACT:
+                return cached[1]
+            alpha, beta = cached[1], cached[2]
+            if alpha >= beta:
+                return cached[3]
+        forced = self.forced_moves(THEIRS) if remaining > 1 else None
+        if forced == []:
+            return 1
+
+        if self.batch_leaves and depth + 1 == self.DEPTH_LIMIT:
+            value, best_move = self.evaluate_frontier(THEIRS, False)
+            if best_move is not None:
+                self.store_tt(key, remaining, value, -math.inf, math.inf, best_move, THEIRS)
+                return value
+
+        value = math.inf
+        best_move = None
+        moves = forced if forced is not None else self.ordered_moves(THEIRS, depth, hash_move, False)
+        for move in moves:
+            self.do_move(THEIRS, move)
+            if best_move is not None and self.pvs and remaining >= self.PVS_MIN_REMAINING:
+                child_value = self.max_node(depth + 1, math.nextafter(beta, -math.inf), beta)
+                if alpha < child_value < beta:
+                    self.stats['researches'] += 1
+                    child_value = self.max_node(depth + 1, alpha, beta)
+            else:
+                child_value = self.max_node(depth + 1, alpha, beta)
+            self.undo_move(THEIRS, move)
+            if child_value < value:
+                value, best_move = child_value, move
+            if value <= alpha:
+                self.record_cutoff(THEIRS, move, depth)
+                break
+            beta = min(beta, value)
+        self.store_tt(key, remaining, value, alpha_orig, beta_orig, best_move, THEIRS)
+        return value
+
+    #Whether side, with at least one threat, can complete it on this move: always with a drop left,
+    #in the move phase only with a piece outside the pattern next to the empty square.
+    def can_win_now(self, side):
+        return (self.piece_counts[side] < PIECES_PER_SIDE or
+                bool(winning_moves(self.position[side], self.position[1 - side])))
+
+    #If the other side can win on its next move, side's moves that stop every such win (possibly none);
+    #None if there is nothing to stop.
+    def forced_moves(self, side):
+        other = 1 - side
+        if not (self.threats[other] and self.can_win_now(other)):
+            return None
+        forced = []
+        for move in self.moves(side):
+            self.do_move(side, move)
+            if not (self.threats[other] and self.can_win_now(other)):
+                forced.append(move)
+            self.undo_move(side, move)
+        return forced
+
+    #side's moves on the search position, as a list. While only a few pieces are down the position is often
+    #symmetric, and then so are its children: on the empty board only 6 of the 25 drops are really different.
+    def search_moves(self, side):
+        moves = list(self.moves(side))
+        if self.piece_counts[MINE] + self.piece_counts[THEIRS] < self.SYMMETRY_PIECES:
+            mover, other = self.position[side], self.position[1 - side]
+            children = set(unique_successors(mover, other, [mover ^ move for move in moves]))
+            moves = [move for move in moves if mover ^ move in children]
+        return moves
+
+    #Evaluates all the leaf children of a node one ply above the depth limit in a single NumPy batch (see
+    #batch_eval.py) instead of one max_value/min_value call each. Every child is evaluated, so the result is exact.
+    #Returns (value, best move) for the maximizing or minimizing side, or (None, None) if side has no moves.
+    def evaluate_frontier(self, side, maximizing):
+        moves = self.search_moves(side)
+        if not moves:
+            return None, None
+        mine, theirs = self.position
+        if side == MINE:
+            boards = self.batch_eval.boards_from_bits([mine ^ move for move in moves], [theirs] * len(moves))
+        else:
+            boards = self.batch_eval.boards_from_bits([mine] * len(moves), [theirs ^ move for move in moves])
+        terminal = self.batch_eval.game_values(boards)
+        values = self.batch_eval.heuristic_values(boards, self.batch_tables, terminal)
+        best = int(values.argmax() if maximizing else values.argmin())
+        self.stats['nodes'] += len(moves)
+        self.stats['leaves'] += int((terminal == 0).sum())
+        return values[best].item(), moves[best]
+
+    #Looking at the clock on every node would be costly, so it is only read once every CLOCK_INTERVAL nodes.
+    #stop_search ends a search early too; it is set from the main thread to cancel pondering.
+    def check_deadline(self):
+        if self.stats['nodes'] & (self.CLOCK_INTERVAL - 1) == 0 and (self.stop_search or
+                                                                     time.perf_counter() > self.deadline):
+            raise SearchTimeout()
+
+    # Transposition table helpers
+
+    #Returns (best move, cached) for key. cached is None when the entry is missing or too shallow to use;
+    #otherwise it is (EXACT, value) or (bound, narrowed alpha, narrowed beta, value).
+    #Deep nodes the table has nothing deep enough for are looked up in the persistent position cache too.
+    def probe_tt(self, key, remaining, alpha, beta, side=MINE):
+        entry = self.tt.probe(key)
+        if ((entry is None or entry[1] < remaining) and self.position_cache is not None and
+                remaining >= self.position_cache.MIN_DEPTH):
+            entry = self.probe_position_cache(key, side) or entry
+        if entry is None:
+            return None, None
+        entry_key, entry_depth, value, bound, best_move, generation = entry
+        if entry_depth < remaining:
+            return best_move, None
+        if bound == EXACT:
+            return best_move, (EXACT, value)
+        if bound == LOWER_BOUND:
+            return best_move, (bound, max(alpha, value), beta, value)
+        return best_move, (bound, alpha, min(beta, value), value)
+
+    #Stores a node's value along with whether it is exact or only a bound: a value at or below the original
+    #alpha means every child failed low (an upper bound), at or above beta means a cutoff (a lower bound).
+    def store_tt(self, key, remaining, value, alpha, beta, best_move, side=MINE):
+        if value <= alpha:
+            bound = UPPER_BOUND
+        elif value >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, remaining, value, bound, best_move)
+        if self.position_cache is not None and remaining >= self.position_cache.MIN_DEPTH:
+            self.store_position_cache(side, remaining, value, bound, best_move)
+
+    # Persistent position cache
+
+    # The position cache (see position_cache.py) keeps results from the point of view of the side to move,
+    # while the search's values are always ours: for the opponent's nodes the value is negated, which swaps
+    # lower and upper bounds.
+
+    #The cache's entry for the search position with side to move, as a transposition table entry under key
+    #(and copied into the table), or None.
+    def probe_position_cache(self, key, side):
+        cached = self.position_cache.probe(self.position[side], self.position[1 - side])
+        if cached is None:
+            return None
+        depth, value, bound, best_move = cached
+        if side == THEIRS:
+            value, bound = -value, _OPPOSITE_BOUNDS[bound]
+        if best_move is not None and not self.is_legal(side, best_move):
+            best_move = None
+        self.tt.store(key, depth, value, bound, best_move)
+        return key, depth, value, bound, best_move, self.tt.generation
+
+    def store_position_cache(self, side, remaining, value, bound, best_move):
+        if side == THEIRS:
+            value, bound = -value, _OPPOSITE_BOUNDS[bound]
+        self.position_cache.store(self.position[side], self.position[1 - side], remaining, value, bound, best_move)
+
+    #What an earlier search left in the position cache for the root, in the form iterative_deepening resumes
+    #from, or None. Only exact results with a legal move qualify.
+    def cached_search(self, mine, theirs):
+        cached = self.position_cache.probe(mine, theirs)
+        if cached is None:
+            return None
+        depth, value, bound, best_move = cached
+        self.set_position(mine, theirs)
+        if bound != EXACT or best_move is None or not self.is_legal(MINE, best_move):
+            return None
+        return {'depth': depth, 'value': value, 'move': best_move, 'pv': [best_move], 'time': 0.0}
+
+    # Move ordering
+
+    # Moves are generated lazily in stages. The transposition table's best move for the position is tried
+    # first, before the other moves are even generated, since it often causes a cutoff on its own.
+    # The rest are sorted by the move the previous iterative deepening iteration played at this depth (its
+    # principal variation), the heuristic value of the resulting state (from the mover's point of view),
+    # whether the move is a killer at this depth (it caused a cutoff in a sibling subtree), and the history
+    # table (how often and how deep it has caused cutoffs). A move is identified by the bits it flips: one bit
+    # for a drop, the source and destination bits for a slide.
+    # The heuristic is skipped one ply above the leaves, where the children are about to be evaluated anyway.
+    def ordered_moves(self, side, depth, hash_move, maximizing):
+        if hash_move is not None and self.is_legal(side, hash_move):
+            yield hash_move
+        moves = self.search_moves(side)
+        if hash_move in moves:
+            moves.remove(hash_move)
+        yield from self.order_moves(side, moves, depth, maximizing)
+
+    def order_moves(self, side, moves, depth, maximizing):
+        killers = self.killers.get(depth, ())
+        history = self.history[side]
+        pv_move = self.pv[depth] if depth < len(self.pv) else None
+        if self.DEPTH_LIMIT - depth > 1:
+            sign = 1 if maximizing else -1
+            evaluate = lambda move: sign * self.child_value(side, move)
+            return sorted(moves, reverse=True,
+                          key=lambda move: (move == pv_move, evaluate(move), move in killers, history.get(move, 0)))
+        return sorted(moves, reverse=True,
+                      key=lambda move: (move == pv_move, move in killers, history.get(move, 0)))
+
+    #The heuristic value of the position after side plays move, from the search position's pattern counts.
+    def child_value(self, side, move):
+        self.do_move(side, move)
+        if self.won[side]:
+            value = 1 if side == MINE else -1
+        else:
+            value = self.leaf_value()
+        self.undo_move(side, move)
+        return value
+
+    #Remembers a move that caused a beta (or alpha) cutoff: two killer slots per depth and a history bonus
+    #that grows with the remaining depth, since cutoffs near the root save the most work.
+    def record_cutoff(self, side, move, depth):
+        self.stats['cutoffs'] += 1
+        killers = self.killers.setdefault(depth, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        remaining = self.DEPTH_LIMIT - depth
+        history = self.history[side]
+        history[move] = history.get(move, 0) + remaining * remaining
+
+    #Resets the node/cutoff counters and killer moves before a new search. History scores are halved rather than
+    #cleared so that they keep guiding the next search without outweighing what it learns itself, and the
+    #transposition table is kept (only aged) so that results from earlier moves in the game are reused.
+    def new_search(self):
+        self.stats = {'nodes': 0, 'leaves': 0, 'cutoffs': 0, 'researches': 0}
+        self.worker_nodes = {}
+        self.killers = {}
+        self.deadline = math.inf
+        self.tt.new_search()
+        self.history = tuple({move: score // 2 for move, score in history.items() if score > 1} for history in self.history)
+
 
     # def max_value(self, state, depth):
     #     """ Minimax algorithm 
@@ -255,6 +1682,8 @@ class TeekoPlayer:
             raise Exception("Illegal move detected")
         # make move
         self.place_piece(move, self.opp)
+        if self.ponder_thread is not None:
+            self.ponder_reply(*self.encode(self.board))
 
     def place_piece(self, move, piece):
         """ Modifies the board representation using the specified move and piece
@@ -294,37 +1723,63 @@ class TeekoPlayer:
         Returns:
             int: 1 if this TeekoPlayer wins, -1 if the opponent wins, 0 if no winner
 
-        TODO: complete checks for diagonal and box wins
+        Wins are looked up against the 44 patterns in WIN_MASKS (rows, columns,
+        both diagonals and every 2x2 box).
         """
-        # check horizontal wins
-        for row in state:
-            for i in range(2):
-                if row[i] != ' ' and row[i] == row[i+1] == row[i+2] == row[i+3]:
-                    return 1 if row[i]==self.my_piece else -1
+        return self.game_value_bits(*self.encode(state))
+
+    def game_value_bits(self, mine, theirs):
+        """ Bitboard version of game_value for a (my bits, opponent bits) pair. """
+        if has_win(mine):
+            return 1
+        if has_win(theirs):
+            return -1
+        return 0 # no winner yet
 
-        # check vertical wins
-        for col in range(5):
-            for i in range(2):
-                if state[i][col] != ' ' and state[i][col] == state[i+1][col] == state[i+2][col] == state[i+3][col]:
-                    return 1 if state[i][col]==self.my_piece else -1
+############################################################################
+#
+# PARALLEL SEARCH WORKERS
+#
+# Each process of a parallel TeekoPlayer's pool holds its own TeekoPlayer and
+# searches one root move per task (see TeekoPlayer.parallel_search_root).
+#
+############################################################################
 
-        # TODO: check \ diagonal wins
-        for row in range(2):
-            for col in range(2):
-                if state[row][col] != ' ' and state[row][col] == state[row+1][col+1] == state[row+2][col+2] == state[row+3][col+3]:
-                    return 1 if state[row][col]==self.my_piece else -1
-        # TODO: check / diagonal wins
-        for row in range(2):
-            for col in range(3,5):
-                if state[row][col] != ' ' and state[row][col] == state[row+1][col-1] == state[row+2][col-2] == state[row+3][col-3]:
-                    return 1 if state[row][col]==self.my_piece else -1
-        # TODO: check box wins
-        for row in range(3):
-            for col in range(3):
-                if state[row][col] != ' ' and state[row][col] == state[row+1][col] == state[row][col+1] == state[row+1][col+1]:
-                    return 1 if state[row][col] == self.my_piece else -1
+_worker_player = None
+_worker_alpha = None
+
+
+def _init_search_worker(shared_alpha, tt_bytes, weights=None, batch_leaves=False, pvs=True, cache_path=None,
+                        cache_readonly=False):
+    global _worker_player, _worker_alpha
+    position_cache = None
+    if cache_path is not None:
+        # the same file mapped in every process, so the workers share its pages and results with the parent
+        from position_cache import PositionCache
+        position_cache = PositionCache.load(cache_path, cache_readonly)
+    _worker_player = TeekoPlayer(tt_bytes=tt_bytes, batch_leaves=batch_leaves, weights=weights, pvs=pvs,
+                                 position_cache=position_cache)
+    _worker_alpha = shared_alpha
+
+
+#Searches the position after one root move to the given depth, starting from the best root value found so far by
+#any process. Returns (value, nodes searched, process id); value is None if the wall-clock deadline passed first.
+def _search_root_child(child, theirs, depth, deadline):
+    player = _worker_player
+    player.new_search()
+    player.DEPTH_LIMIT = depth
+    player.deadline = time.perf_counter() + (deadline - time.time())
+    alpha = _worker_alpha.value
+    try:
+        value = player.min_value_bits(child, theirs, 1, alpha, math.inf)
+    except SearchTimeout:
+        return None, player.stats['nodes'], os.getpid()
+    if value > alpha:
+        with _worker_alpha.get_lock():
+            if value > _worker_alpha.value:
+                _worker_alpha.value = value
+    return value, player.stats['nodes'], os.getpid()
 
-        return 0 # no winner yet
 
 ############################################################################
 #
@@ -409,12 +1864,9 @@ def test_minimax_depth(ai, initial_state):
             # records the current time (in seconds) before running the Minimax algorithm. This is the starting time of the test.
             start_time = time.time()
 
-            # sets the DEPTH_LIMIT attribute of the TeekoPlayer instance to the current depth limit being tested.
-            # this determines how deep the Minimax algorithm will go during this test iteration.
-            ai.DEPTH_LIMIT = depth 
-
-            #Calls the make_move method of the TeekoPlayer instance with the initial_state 
-            ai.make_move(initial_state)
+            #Calls the make_move method of the TeekoPlayer instance with the initial_state, without a time budget and
+            #with the current depth limit being tested, so that iterative deepening stops after this depth.
+            ai.make_move(initial_state, time_budget=math.inf, max_depth=depth)
 
             #Records the current time immediately after the Minimax algorithm finishes. This is the ending time of the test.
             end_time = time.time()
@@ -501,18 +1953,94 @@ def test_heuristics():
         #Prints out the index of the state (adjusted to start from 1 instead of 0), along with the calculated game value and heuristic value.
         print(f"State {i+1}: Game Value = {game_val}, Heuristic Value = {heuristic_val}")
 
-            
+    return test_states
+
+
+#Searches each of the given states, with each color to move, to the same depth with principal variation search and
+#aspiration windows and with plain alpha-beta, and prints the nodes each needed. Both must find the same value, and
+#the former must not need more nodes in total. Returns the (PVS, plain) totals.
+def test_pvs_nodes(states, depth=6):
+    totals = {True: 0, False: 0}
+    for i, state in enumerate(states):
+        for piece in TeekoPlayer.pieces:
+            nodes = {}
+            for pvs in (True, False):
+                #A fresh player for each search, so that neither starts from the other's transposition table.
+                player = TeekoPlayer(pvs=pvs)
+                player.my_piece, player.opp = piece, 'r' if piece == 'b' else 'b'
+                mine, theirs = player.encode(state)
+                if player.game_value_bits(mine, theirs) != 0:
+                    break
+                player.iterative_deepening(mine, theirs, math.inf, depth)
+                nodes[pvs] = (player.last_search['nodes'], player.last_search['value'])
+                totals[pvs] += nodes[pvs][0]
+            else:
+                assert nodes[True][1] == nodes[False][1]
+                print(f"State {i+1}, {piece} to move: depth {depth}, PVS {nodes[True][0]} nodes, plain {nodes[False][0]} nodes")
+    print(f"Total: PVS {totals[True]} nodes, plain {totals[False]} nodes")
+    assert totals[True] <= totals[False]
+    return totals[True], totals[False]
+
+
+#Searches the same mid drop phase position serially and with a pool of worker processes, with heuristic weights other
+#than the defaults (these unless others are given), and checks that both find the same value: the workers must search
+#with the player's weights.
+def test_parallel_search(depth=4, weights=None):
+    if weights is None:
+        weights = {'two': 3, 'three': 0.5, 'center': 1, 'mobility': 0}
+    state = [[' ', ' ', ' ', ' ', ' '],
+             [' ', 'b', 'r', ' ', ' '],
+             [' ', ' ', 'b', ' ', ' '],
+             [' ', ' ', ' ', 'r', ' '],
+             [' ', ' ', ' ', ' ', ' ']]
+    values = {}
+    for workers in (1, 2):
+        player = TeekoPlayer(weights=weights, workers=workers)
+        player.my_piece, player.opp = 'b', 'r'
+        move = player.iterative_deepening(*player.encode(state), math.inf, depth)
+        values[workers] = player.last_search['value']
+        player.close()
+        print(f"{workers} workers: move {move}, value {values[workers]}")
+    assert values[1] == values[2]
+
+
+#Loads the opening book built by opening_book.py, if one has been built next to this file.
+def load_opening_book():
+    from opening_book import OpeningBook, DEFAULT_BOOK_PATH
+    if not os.path.exists(DEFAULT_BOOK_PATH):
+        return None
+    return OpeningBook.load(DEFAULT_BOOK_PATH)
+
+
+#Memory-maps the move phase tablebase built by tablebase.py, if one has been built next to this file.
+def load_tablebase():
+    from tablebase import Tablebase, DEFAULT_TABLEBASE_PATH
+    if not os.path.exists(DEFAULT_TABLEBASE_PATH):
+        return None
+    return Tablebase.load(DEFAULT_TABLEBASE_PATH)
+
+
+#Memory-maps the persistent position cache, if one has been created next to this file with position_cache.py.
+def load_position_cache():
+    from position_cache import PositionCache, DEFAULT_CACHE_PATH
+    if not os.path.exists(DEFAULT_CACHE_PATH):
+        return None
+    return PositionCache.load(DEFAULT_CACHE_PATH)
 
 
 def main():
     print('Hello, this is Samaritan')
-    ai = TeekoPlayer()
+    # the AI ponders while waiting for the opponent's moves at the input() prompts below
+    ai = TeekoPlayer(opening_book=load_opening_book(), tablebase=load_tablebase(), ponder=True,
+                     position_cache=load_position_cache())
     piece_count = 0
     turn = 0
     test_succ_function()
 
     test_heuristics()
 
+    test_parallel_search()
+
     initial_state = [[' ' for j in range(5)] for i in range(5)]  # Example initial state
     test_minimax_depth(ai, initial_state)
 
@@ -583,6 +2111,7 @@ def main():
         print("AI wins! Game over.")
     else:
         print("You win! Game over.")
+    ai.close()
 
 
 
@@ -0,0 +1,247 @@
+""" Monte Carlo tree search for TeekoPlayer, an alternative to the minimax search.
+
+Instead of cutting the tree off at a depth and trusting the heuristic there,
+MCTS plays many quick games (playouts) to the end from the positions it
+grows, and spends the most visits on the moves that win them most often:
+
+    selection    from the root, follow the child with the highest UCT score
+                 wins / visits + exploration * sqrt(ln parent visits / visits)
+                 until a node still has untried moves
+    expansion    add the position after one of them
+    simulation   play batch_size playouts from it
+    backup       add the results to every node on the path, each from the
+                 point of view of the side that moved into it
+
+The move played is the root child with the most visits. Playouts pick random
+moves among generate_moves (the bitboard successors succ is built on), ending
+with a win as has_win (game_value) sees it, or a draw after MAX_PLAYOUT_PLIES.
+Guided playouts also take a win when there is one and block the opponent's
+win when it has one.
+
+The tree is kept between moves: the next search starts from the node of the
+position reached, found among the old root's children and grandchildren, with
+all the visits it already has. With workers > 1 the search is root parallel:
+every worker process grows its own tree for the whole time budget and the
+visit counts of the root moves are added up.
+
+Use it with TeekoPlayer(mcts=MCTSSearch(...)); the player still answers from
+the opening book, the tablebase and the threat checks first.
+"""
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import blocking_moves, generate_moves, has_win, winning_moves
+
+MAX_PLAYOUT_PLIES = 40  # a playout still undecided after this many plies counts as a draw
+CLOCK_INTERVAL = 16  # iterations between looks at the clock
+
+
+class Node:
+    """ A position in the search tree, with mover to move. score is the sum of the playout results
+    (1 win, 0.5 draw, 0 loss) for the side that moved into it, over its visits.
+    """
+    __slots__ = ('mover', 'other', 'move', 'parent', 'children', 'untried', 'visits', 'score', 'won')
+
+    def __init__(self, mover, other, move=None, parent=None):
+        self.mover = mover
+        self.other = other
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.score = 0.0
+        # whether the move into this node completed a pattern, which ends the game
+        self.won = has_win(other)
+
+    def size(self):
+        return 1 + sum(child.size() for child in self.children)
+
+
+class MCTSSearch:
+    """ UCT search with playouts, tree reuse between moves and optional root parallelism. """
+
+    def __init__(self, exploration=math.sqrt(2), batch_size=1, guided=True, workers=1, max_playouts=None,
+                 seed=None):
+        """
+        Args:
+            exploration (float): the UCT exploration constant; higher spreads the visits wider.
+            batch_size (int): playouts per expanded node, backed up together.
+            guided (bool): playouts take immediate wins and block immediate losses instead of
+                moving at random.
+            workers (int): processes growing independent trees (root parallelism); 1 searches
+                in this process only. Call close() to stop the worker pool.
+            max_playouts (int): stop after this many playouts even with time left, for
+                reproducible searches.
+            seed: seed of the playout random number generator.
+        """
+        self.exploration = exploration
+        self.batch_size = batch_size
+        self.guided = guided
+        self.workers = workers
+        self.max_playouts = max_playouts
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.root = None
+        self.pool = None
+        self.last_search = None
+
+    def search(self, mover, other, time_budget):
+        """ The bits of the best move for mover; a summary is left in self.last_search. """
+        start = time.perf_counter()
+        if self.workers > 1:
+            stats, playouts, reused, tree = self.parallel_root_stats(mover, other, time_budget)
+        else:
+            root = self.reuse_root(mover, other)
+            reused = root.visits
+            playouts = self.grow(root, start + time_budget)
+            stats = {child.move: (child.visits, child.score) for child in root.children}
+            tree = root.size()
+        if not stats:
+            raise Exception("No legal moves")
+        move = max(stats, key=lambda move: stats[move][0])
+        visits, score = stats[move]
+        self.last_search = {'mcts': True, 'move': move, 'value': score / visits if visits else 0.5,
+                            'playouts': playouts, 'reused': reused, 'tree_nodes': tree,
+                            'time': time.perf_counter() - start}
+        return move
+
+    #The old tree's node for (mover, other) if it is the old root or two plies below it at most, as the new root;
+    #otherwise a fresh root.
+    def reuse_root(self, mover, other):
+        root = self.root
+        if root is not None:
+            candidates = [root] + root.children + [grandchild for child in root.children for grandchild in child.children]
+            root = next((node for node in candidates if node.mover == mover and node.other == other), None)
+        if root is None:
+            root = Node(mover, other)
+        root.parent = None
+        self.root = root
+        return root
+
+    #Runs select/expand/simulate/backup iterations until the deadline (or max_playouts). Returns the number of playouts.
+    def grow(self, root, deadline):
+        playouts = 0
+        iteration = 0
+        while self.max_playouts is None or playouts < self.max_playouts:
+            if iteration % CLOCK_INTERVAL == 0 and iteration and time.perf_counter() > deadline:
+                break
+            iteration += 1
+            node = self.select(root)
+            if node.won:
+                # the side that moved into node has won: every playout from here is a win for it
+                result, count = float(self.batch_size), self.batch_size
+            else:
+                count = self.batch_size
+                # playout results are for the side to move at node, the backup wants them for the side that moved in
+                result = count - sum(self.playout(node.mover, node.other) for playout in range(count))
+            self.backup(node, result, count)
+            playouts += count
+        return playouts
+
+    #Follows UCT down to a node with untried moves, or a finished game, and expands one child there.
+    def select(self, node):
+        exploration = self.exploration
+        while not node.won:
+            if node.untried is None:
+                node.untried = self.candidate_moves(node.mover, node.other)
+            if node.untried:
+                move = node.untried.pop(self.random.randrange(len(node.untried)))
+                child = Node(node.other, node.mover ^ move, move, node)
+                node.children.append(child)
+                return child
+            if not node.children:
+                return node  # no legal moves
+            log_visits = math.log(node.visits)
+            node = max(node.children, key=lambda child: child.score / child.visits +
+                       exploration * math.sqrt(log_visits / child.visits))
+        return node
+
+    #The moves to expand at a node. With guided playouts a win on the spot makes every other move pointless.
+    def candidate_moves(self, mover, other):
+        if self.guided:
+            wins = winning_moves(mover, other)
+            if wins:
+                return wins[:1]
+        return list(generate_moves(mover, other))
+
+    def backup(self, node, result, count):
+        while node is not None:
+            node.visits += count
+            node.score += result
+            result = count - result
+            node = node.parent
+
+    #Plays one game out from (mover, other) with mover to move. Returns 1 if mover wins, 0 if it loses, 0.5 for a draw.
+    def playout(self, mover, other):
+        choice = self.random.choice
+        guided = self.guided
+        result = 1.0
+        for ply in range(MAX_PLAYOUT_PLIES):
+            if guided:
+                if winning_moves(mover, other):
+                    return result
+                moves = blocking_moves(mover, other)
+                if moves == []:
+                    return 1.0 - result  # the opponent's win can't be stopped
+                if moves is None:
+                    moves = list(generate_moves(mover, other))
+            else:
+                moves = list(generate_moves(mover, other))
+            if not moves:
+                return 0.5
+            mover ^= choice(moves)
+            if not guided and has_win(mover):
+                return result
+            mover, other = other, mover
+            result = 1.0 - result
+        return 0.5
+
+    #Root parallelism: every worker grows its own tree (kept between its tasks, like the one here) for the
+    #time budget; the root moves' visits and scores are summed over the workers.
+    def parallel_root_stats(self, mover, other, time_budget):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_mcts_worker,
+                                            initargs=(self.exploration, self.batch_size, self.guided, self.seed))
+        max_playouts = None if self.max_playouts is None else -(-self.max_playouts // self.workers)
+        futures = [self.pool.submit(_mcts_worker_search, mover, other, time_budget, max_playouts)
+                   for worker in range(self.workers)]
+        stats, playouts, reused, tree = {}, 0, 0, 0
+        for future in futures:
+            worker_stats, worker_playouts, worker_reused, worker_tree = future.result()
+            for move, (visits, score) in worker_stats.items():
+                total_visits, total_score = stats.get(move, (0, 0.0))
+                stats[move] = (total_visits + visits, total_score + score)
+            playouts += worker_playouts
+            reused += worker_reused
+            tree += worker_tree
+        return stats, playouts, reused, tree
+
+    #Shuts down the worker processes of a root parallel search.
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+# each worker process of a root parallel search holds its own MCTSSearch, and with it its own tree
+_worker_search = None
+
+
+def _init_mcts_worker(exploration, batch_size, guided, seed):
+    global _worker_search
+    # workers must not all play the same playouts
+    _worker_search = MCTSSearch(exploration, batch_size, guided, seed=None if seed is None else seed + os.getpid())
+
+
+#Grows the worker's tree for time_budget seconds. Returns ({root move: (visits, score)}, playouts, reused visits, tree size).
+def _mcts_worker_search(mover, other, time_budget, max_playouts):
+    search = _worker_search
+    search.max_playouts = max_playouts
+    root = search.reuse_root(mover, other)
+    reused = root.visits
+    playouts = search.grow(root, time.perf_counter() + time_budget)
+    return {child.move: (child.visits, child.score) for child in root.children}, playouts, reused, root.size()
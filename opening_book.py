@@ -0,0 +1,141 @@
+""" Opening book for the Teeko drop phase.
+
+Every game starts from the same empty board, so the first few drops are the
+same problem over and over. This module searches them once, offline, and saves
+the best drop for every position to a small binary file that TeekoPlayer can
+answer from with a dict lookup.
+
+Positions are stored in canonical form (see game.canonical_form), so each
+position is searched and stored once for all 8 of its mirror images. Every
+position is keyed from the side to move: mover holds the bits of the player
+about to drop and other the bits of its opponent.
+
+File layout (little endian):
+    header:  4 byte magic b'TKOB', uint16 version, uint32 record count
+    records: one uint64 per position, sorted, holding
+             (canonical mover bits << 25 | canonical other bits) << 5 | square
+             where square is the best drop on the canonical board.
+
+Usage:
+    python opening_book.py build [--plies 4] [--depth 6] [--time-budget 10] [--output opening_book.bin]
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+from array import array
+
+from game import (NUM_SQUARES, SYMMETRIES, INVERSE_SYMMETRIES, TeekoPlayer, bit_successors,
+                  canonical_form)
+
+BOOK_MAGIC = b'TKOB'
+BOOK_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+DEFAULT_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.bin')
+
+
+class OpeningBook:
+    """ Best drops for the opening positions, keyed by canonical position. """
+
+    def __init__(self, moves=None):
+        # canonical (mover << 25 | other) -> best square on the canonical board
+        self.moves = moves if moves is not None else {}
+
+    def __len__(self):
+        return len(self.moves)
+
+    def lookup(self, mover, other):
+        """ Returns the book move for mover as the bit of the square to drop on, or None
+        if the position is not in the book.
+        """
+        canonical_mover, canonical_other, symmetry = canonical_form(mover, other)
+        square = self.moves.get(canonical_mover << NUM_SQUARES | canonical_other)
+        if square is None:
+            return None
+        # undo the symmetry that produced the canonical board
+        return 1 << SYMMETRIES[INVERSE_SYMMETRIES[symmetry]][square]
+
+    def add(self, mover, other, move):
+        """ Stores move (the bit of the square to drop on) for the position. """
+        canonical_mover, canonical_other, symmetry = canonical_form(mover, other)
+        square = SYMMETRIES[symmetry][move.bit_length() - 1]
+        self.moves[canonical_mover << NUM_SQUARES | canonical_other] = square
+
+    def save(self, path=DEFAULT_BOOK_PATH):
+        records = array('Q', sorted(key << 5 | square for key, square in self.moves.items()))
+        if sys.byteorder == 'big':
+            records.byteswap()
+        with open(path, 'wb') as book_file:
+            book_file.write(_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(records)))
+            records.tofile(book_file)
+
+    @classmethod
+    def load(cls, path=DEFAULT_BOOK_PATH):
+        with open(path, 'rb') as book_file:
+            magic, version, count = _HEADER.unpack(book_file.read(_HEADER.size))
+            if magic != BOOK_MAGIC or version != BOOK_VERSION:
+                raise ValueError(f"{path} is not a version {BOOK_VERSION} opening book")
+            records = array('Q')
+            records.fromfile(book_file, count)
+        if sys.byteorder == 'big':
+            records.byteswap()
+        return cls({record >> 5: record & 31 for record in records})
+
+
+def book_positions(plies):
+    """ Returns every canonical (mover, other) position reachable in fewer than plies drops. """
+    positions = []
+    frontier = {(0, 0)}
+    for ply in range(plies):
+        positions.extend(sorted(frontier))
+        next_frontier = set()
+        for mover, other in frontier:
+            for child in bit_successors(mover, other):
+                # after the drop it is the other player's turn
+                next_frontier.add(canonical_form(other, child)[:2])
+        frontier = next_frontier
+    return positions
+
+
+def build_book(plies=4, depth=6, time_budget=10.0, progress=None):
+    """ Searches every position of the first plies drops and returns the resulting OpeningBook.
+
+    Each position gets an iterative deepening search up to depth, cut short after
+    time_budget seconds. The same player (and so the same transposition table) is
+    used for every position, since neighbouring book positions share most subtrees.
+    """
+    player = TeekoPlayer()
+    book = OpeningBook()
+    positions = book_positions(plies)
+    for index, (mover, other) in enumerate(positions):
+        move = player.iterative_deepening(mover, other, time_budget, depth)
+        book.add(mover, other, move)
+        if progress is not None:
+            progress(index + 1, len(positions), player.last_search)
+    return book
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Teeko drop phase opening book.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="search the opening positions and write the book")
+    build.add_argument('--plies', type=int, default=4, help="cover positions with fewer than this many pieces down")
+    build.add_argument('--depth', type=int, default=6, help="search depth per position")
+    build.add_argument('--time-budget', type=float, default=10.0, help="seconds per position")
+    build.add_argument('--output', default=DEFAULT_BOOK_PATH)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def progress(done, total, search):
+        print(f"{done}/{total}: depth {search['depth']}, value {search['value']}, "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    book = build_book(args.plies, args.depth, args.time_budget, progress)
+    book.save(args.output)
+    print(f"Wrote {len(book)} positions to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+""" Move generator node counts (perft) for checking correctness.
+
+perft(position, depth) is the number of move sequences of exactly depth plies
+from the position, with the sides alternating. A position where either side
+has won ends the game and has no moves, so it only counts at depth 0. The
+counts depend on nothing but the rules, so comparing them against the known
+values below checks generate_moves (and TeekoPlayer.succ, with --succ) for
+missing, duplicated or illegal moves after any change to them.
+
+The known counts were computed with an independent implementation of the
+rules on plain strings.
+
+Usage:
+    python perft.py [--depth 4] [--succ] [--divide NAME]
+"""
+import argparse
+import sys
+import time
+
+from game import TeekoPlayer, encode_state, generate_moves, has_win
+
+# (name, color to move, board rows with '.' for an empty square, perft counts for depth 1, 2, ...)
+PERFT_POSITIONS = [
+    ('empty', 'b', ['.....', '.....', '.....', '.....', '.....'], [25, 600, 13800, 303600]),
+    ('mid-drop', 'b', ['.....', '.br..', '..b..', '...r.', '.....'], [21, 420, 7980, 143640]),
+    ('last-drops', 'b', ['..r..', '.b.b.', '..r..', '..b..', '....r'], [19, 342, 7072, 101269, 2007134]),
+    ('move-diagonal', 'b', ['b....', '.rb..', '..r.b', '.b.r.', 'r....'], [18, 315, 5429, 99039, 1676254]),
+    ('move-threat', 'b', ['....r', '.bb..', '.rrr.', '.b.b.', '.....'], [21, 324, 6569, 107857, 2065815]),
+    ('move-open', 'r', ['.b...', 'br...', '.r.r.', '..r.b', '....b'], [22, 226, 4775, 56282, 1159316]),
+]
+
+
+def position_state(rows):
+    return [[' ' if cell == '.' else cell for cell in row] for row in rows]
+
+
+def position_bits(color, rows):
+    """ (mover bits, other bits) for the position with color to move. """
+    state = position_state(rows)
+    return encode_state(state, color), encode_state(state, 'r' if color == 'b' else 'b')
+
+
+def perft(mover, other, depth):
+    """ Number of depth ply move sequences from (mover, other) with mover to move. """
+    if depth == 0:
+        return 1
+    if has_win(mover) or has_win(other):
+        return 0
+    if depth == 1:
+        return sum(1 for move in generate_moves(mover, other))
+    return sum(perft(other, mover ^ move, depth - 1) for move in generate_moves(mover, other))
+
+
+def divide(mover, other, depth):
+    """ perft split by root move, as {move bits: count}, for tracking down a wrong total. """
+    return {move: perft(other, mover ^ move, depth - 1) for move in generate_moves(mover, other)}
+
+
+def succ_perft(player, state, piece, depth):
+    """ perft through the list of lists API: TeekoPlayer.succ and game_value. """
+    if depth == 0:
+        return 1
+    if player.game_value(state) != 0:
+        return 0
+    other = 'r' if piece == 'b' else 'b'
+    return sum(succ_perft(player, child, other, depth - 1) for child in player.succ(state, piece))
+
+
+def run_perft(max_depth, use_succ=False):
+    """ Checks every position up to max_depth (or as deep as its counts are known).
+    Returns a list of (name, depth, expected, actual, seconds).
+    """
+    results = []
+    player = TeekoPlayer()
+    for name, color, rows, counts in PERFT_POSITIONS:
+        for depth, expected in enumerate(counts[:max_depth], 1):
+            start = time.perf_counter()
+            if use_succ:
+                actual = succ_perft(player, position_state(rows), color, depth)
+            else:
+                actual = perft(*position_bits(color, rows), depth)
+            results.append((name, depth, expected, actual, time.perf_counter() - start))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the move generator against known perft counts.")
+    parser.add_argument('--depth', type=int, default=4, help="deepest perft to run per position")
+    parser.add_argument('--succ', action='store_true', help="count through TeekoPlayer.succ instead of generate_moves")
+    parser.add_argument('--divide', metavar='NAME', default=None,
+                        help="print the --depth count of one position split by root move")
+    args = parser.parse_args(argv)
+
+    if args.divide is not None:
+        color, rows = next((color, rows) for name, color, rows, counts in PERFT_POSITIONS if name == args.divide)
+        for move, count in sorted(divide(*position_bits(color, rows), args.depth).items()):
+            squares = [f"{'ABCDE'[square % 5]}{square // 5}" for square in range(25) if move >> square & 1]
+            print(f"{'-'.join(squares):6} {count}")
+        return 0
+
+    failed = False
+    for name, depth, expected, actual, seconds in run_perft(args.depth, args.succ):
+        status = 'ok' if actual == expected else f'MISMATCH (expected {expected})'
+        failed = failed or actual != expected
+        print(f"{name:14} depth {depth}  {actual:10d}  {seconds:8.3f}s  {actual / seconds if seconds else 0:10.0f} nodes/s  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+""" Persistent cache of searched positions, shared between processes and runs.
+
+The transposition table starts empty in every process. This cache keeps the
+deeper search results on disk, so that later games, restarts and other worker
+processes start from them: TeekoPlayer looks positions up here when its
+transposition table has nothing deep enough, and writes back the results of
+nodes with at least PositionCache.MIN_DEPTH plies below them.
+
+Positions are keyed from the side to move, in canonical form (see
+game.canonical_form): (mover << 25 | other), so a position and its mirror
+images share one entry. Values are from the mover's point of view and best
+moves are stored on the canonical board.
+
+The file is a fixed-size hash table of buckets of BUCKET_SLOTS slots, memory-
+mapped shared, so every process using it reads and writes the same pages
+without copying them; load only asks the OS to read the file ahead, so the
+first searches don't wait on it page by page. The size cap is set when the file is
+created. Once a bucket is full, a new result evicts the slot with the
+shallowest result, unless every slot holds a deeper one. Writers take no
+locks: each slot holds check = key ^ value ^ meta next to value and meta, so
+a slot torn by two processes writing at once fails the check and reads as
+empty.
+
+Search values depend on the heuristic weights, so the file records the
+weights it was filled with and only players with the same weights use it.
+
+File layout (little endian):
+    header:  4 byte magic b'TKOC', uint16 version, uint32 bucket count, 4 float64
+             weights (two, three, center, mobility)
+    slots:   bucket count * BUCKET_SLOTS slots of 3 uint64: check, value (float64
+             bits) and meta = depth | bound << 8 | first move square + 1 << 10 |
+             second move square + 1 << 15, with both squares 0 for no move
+
+Usage:
+    python position_cache.py create [--size-mb 64] [--path positions.cache]
+    python position_cache.py stats [--path positions.cache]
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+from game import DEFAULT_WEIGHTS, INVERSE_SYMMETRIES, NUM_SQUARES, canonical_form, transform_bits
+
+CACHE_MAGIC = b'TKOC'
+CACHE_VERSION = 1
+_HEADER = struct.Struct('<4sHxxI4d')
+_SLOT = struct.Struct('<QdQ')
+_VALUE_BITS = struct.Struct('<d')
+_WEIGHT_NAMES = ('two', 'three', 'center', 'mobility')
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'positions.cache')
+
+BUCKET_SLOTS = 4
+_BUCKET_BYTES = BUCKET_SLOTS * _SLOT.size
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK_64 = (1 << 64) - 1
+
+
+def _value_bits(value):
+    return int.from_bytes(_VALUE_BITS.pack(value), 'little')
+
+
+def _encode_meta(depth, bound, move):
+    squares = [square + 1 for square in range(NUM_SQUARES) if move and move >> square & 1] + [0, 0]
+    return min(depth, 255) | bound << 8 | squares[0] << 10 | squares[1] << 15
+
+
+def _decode_meta(meta):
+    move = 0
+    for square in (meta >> 10 & 31, meta >> 15 & 31):
+        if square:
+            move |= 1 << (square - 1)
+    return meta & 255, meta >> 8 & 3, move or None
+
+
+class PositionCache:
+    """ A memory-mapped table of (depth, value, bound, best move) per canonical position. """
+
+    MIN_DEPTH = 3  # results with fewer plies searched below them are cheap to redo and are not kept
+
+    def __init__(self, data, buckets, weights, path=None, readonly=False):
+        self.data = data
+        self.readonly = readonly
+        self.buckets = buckets
+        self.shift = 64 - (buckets.bit_length() - 1)
+        self.weights = weights
+        self.path = path
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    @classmethod
+    def create(cls, path=DEFAULT_CACHE_PATH, max_bytes=64 * 1024 * 1024, weights=None):
+        """ Writes an empty cache of at most max_bytes (rounded down to a power of two number of buckets). """
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        buckets = max(1, max_bytes // _BUCKET_BYTES)
+        buckets = 1 << (buckets.bit_length() - 1)
+        with open(path, 'wb') as cache_file:
+            cache_file.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, buckets,
+                                          *(weights[name] for name in _WEIGHT_NAMES)))
+            cache_file.truncate(_HEADER.size + buckets * _BUCKET_BYTES)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CACHE_PATH, readonly=False):
+        """ Maps an existing cache. Every process that loads the same file shares its pages. """
+        with open(path, 'rb' if readonly else 'r+b') as cache_file:
+            data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        magic, version, buckets, *weights = _HEADER.unpack(data[:_HEADER.size])
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError(f"{path} is not a version {CACHE_VERSION} position cache")
+        if len(data) != _HEADER.size + buckets * _BUCKET_BYTES:
+            raise ValueError(f"{path} is truncated")
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            # warm the page cache now rather than faulting pages in one at a time during the first searches
+            data.madvise(mmap.MADV_WILLNEED)
+        return cls(data, buckets, dict(zip(_WEIGHT_NAMES, weights)), path, readonly)
+
+    def bucket_offset(self, key):
+        return _HEADER.size + ((key * _HASH_MULTIPLIER & _MASK_64) >> self.shift) * _BUCKET_BYTES
+
+    def probe(self, mover, other):
+        """ Returns (depth, value, bound, best move) for mover to move, or None. """
+        canonical_mover, canonical_other, symmetry = canonical_form(mover, other)
+        key = canonical_mover << NUM_SQUARES | canonical_other
+        offset = self.bucket_offset(key)
+        for slot in range(offset, offset + _BUCKET_BYTES, _SLOT.size):
+            check, value, meta = _SLOT.unpack_from(self.data, slot)
+            if check and check ^ _value_bits(value) ^ meta == key:
+                self.hits += 1
+                depth, bound, move = _decode_meta(meta)
+                if move is not None:
+                    move = transform_bits(move, INVERSE_SYMMETRIES[symmetry])
+                return depth, value, bound, move
+        self.misses += 1
+        return None
+
+    def store(self, mover, other, depth, value, bound, best_move):
+        """ Keeps a result for mover to move, replacing a shallower one for the same position if there is one. """
+        if self.readonly:
+            return
+        canonical_mover, canonical_other, symmetry = canonical_form(mover, other)
+        key = canonical_mover << NUM_SQUARES | canonical_other
+        if best_move is not None:
+            best_move = transform_bits(best_move, symmetry)
+        offset = self.bucket_offset(key)
+        victim, victim_depth = None, None
+        for slot in range(offset, offset + _BUCKET_BYTES, _SLOT.size):
+            check, stored_value, meta = _SLOT.unpack_from(self.data, slot)
+            stored_key = check ^ _value_bits(stored_value) ^ meta
+            if not check or stored_key == key:
+                if check and meta & 255 > depth:
+                    return
+                victim = slot
+                break
+            if victim is None or meta & 255 < victim_depth:
+                victim, victim_depth = slot, meta & 255
+        else:
+            if victim_depth > depth:
+                return
+            self.evictions += 1
+        meta = _encode_meta(depth, bound, best_move)
+        _SLOT.pack_into(self.data, victim, key ^ _value_bits(value) ^ meta, value, meta)
+        self.stores += 1
+
+    def filled(self):
+        """ (number of filled slots, {depth: count}). """
+        depths = {}
+        for slot in range(_HEADER.size, len(self.data), _SLOT.size):
+            check, value, meta = _SLOT.unpack_from(self.data, slot)
+            if check:
+                depths[meta & 255] = depths.get(meta & 255, 0) + 1
+        return sum(depths.values()), depths
+
+    def close(self):
+        """ Writes pending changes back to the file and unmaps it. """
+        if not self.data.closed:
+            if not self.readonly:
+                self.data.flush()
+            self.data.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or inspect the persistent Teeko position cache.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create = subparsers.add_parser('create', help="write an empty cache")
+    create.add_argument('--size-mb', type=float, default=64, help="size cap of the file")
+    create.add_argument('--path', default=DEFAULT_CACHE_PATH)
+    stats = subparsers.add_parser('stats', help="count the cached positions by depth")
+    stats.add_argument('--path', default=DEFAULT_CACHE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        cache = PositionCache.create(args.path, int(args.size_mb * 1024 * 1024))
+        print(f"Wrote {args.path}: {cache.buckets * BUCKET_SLOTS} slots")
+    else:
+        cache = PositionCache.load(args.path, readonly=True)
+        filled, depths = cache.filled()
+        print(f"{args.path}: {filled} of {cache.buckets * BUCKET_SLOTS} slots filled")
+        for depth, count in sorted(depths.items()):
+            print(f"  depth {depth:3}: {count}")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+""" Opt-in instrumentation of TeekoPlayer's search.
+
+A player built with TeekoPlayer(profiler=SearchProfiler()) reports where its
+time goes. The profiler replaces the search's methods on that one instance
+with timing wrappers, so players without a profiler run the unchanged class
+methods and pay nothing for it.
+
+For every make_move (or choose_move, or iterative_deepening called directly)
+the profiler records one dict in
+self.moves, and writes it as a JSON line to log if one was given:
+
+    source      what chose the move: book, tablebase, threats or search
+    seconds     wall-clock time of the whole move
+    depth, nodes, leaves, cutoffs, researches
+                from the search's own counters (0 when it didn't search); researches
+                are null window and aspiration window searches that had to be redone
+    tt_probes, tt_hits
+                transposition table lookups, and those whose entry was deep
+                enough to answer the node or narrow its window
+    calls       number of calls per instrumented method
+    phases      seconds spent in each phase below, excluding time spent in
+                instrumented methods they call (so the phases add up to seconds)
+
+The phases are:
+
+    generate    move generation (search_moves, succ)
+    order       move ordering (order_moves)
+    evaluate    heuristic evaluation (leaf_value, child_value, evaluate_frontier, heuristic_bits)
+    terminal    win and forced move checks (can_win_now, forced_moves, game_value_bits)
+    tt          transposition table probes and stores
+    make        do_move and undo_move
+    search      the rest of max_node/min_node
+    other       the rest of the move (book, tablebase and threat lookups, the root of
+                each iteration, following the principal variation)
+
+The same self times are also kept per call stack, with max_node/min_node
+frames for each ply, and write_folded writes them in the folded stack format
+flamegraph.pl, inferno and speedscope read:
+
+    profiler.write_folded('search.folded')
+    $ flamegraph.pl search.folded > search.svg
+
+Timing every call makes the search several times slower while profiling, and
+that overhead lands mostly in the hottest methods, so compare phases against
+each other rather than against an unprofiled run. With workers > 1 only the
+part of the search done in this process is timed, and a pondering player's
+background searches are timed (and recorded as moves) along with its own.
+"""
+import json
+import time
+
+# instrumented method -> phase its own time is counted in
+PHASES = {'choose_move': 'other', 'book_move': 'other', 'tablebase_move': 'other', 'threat_move': 'other',
+          'iterative_deepening': 'other', 'search_root': 'other', 'parallel_search_root': 'other',
+          'aspiration_search': 'other',
+          'principal_variation': 'other',
+          'max_node': 'search', 'min_node': 'search',
+          'search_moves': 'generate', 'succ': 'generate',
+          'order_moves': 'order',
+          'leaf_value': 'evaluate', 'child_value': 'evaluate', 'evaluate_frontier': 'evaluate',
+          'heuristic_bits': 'evaluate',
+          'can_win_now': 'terminal', 'forced_moves': 'terminal', 'game_value_bits': 'terminal',
+          'probe_tt': 'tt', 'store_tt': 'tt',
+          'do_move': 'make', 'undo_move': 'make'}
+
+
+class SearchProfiler:
+    """ Counters, per phase timing and call stacks of one player's searches. """
+
+    def __init__(self, log=None):
+        """
+        Args:
+            log (file): optional text file the per-move stats are written to, one JSON object per line.
+        """
+        self.log = log
+        self.moves = []
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        # self time per call stack, as 'choose_move;max_node;min_node;leaf_value' -> seconds
+        self.stacks = {}
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # one [stack, time spent in instrumented callees] per active call
+        self.frames = [['', 0.0]]
+        self.recording = False
+
+    def attach(self, player):
+        """ Instruments player's search. Called by TeekoPlayer when given a profiler. """
+        for name in PHASES:
+            setattr(player, name, self.timed(name, getattr(player, name)))
+        probe = player.probe_tt
+
+        def probe_tt(*args):
+            result = probe(*args)
+            self.tt_probes += 1
+            if result[1] is not None:
+                self.tt_hits += 1
+            return result
+        player.probe_tt = probe_tt
+
+        player.choose_move = self.recorded(player, player.choose_move)
+        player.iterative_deepening = self.recorded(player, player.iterative_deepening)
+
+    #Wraps choose_move or iterative_deepening so that each outermost call records one move.
+    def recorded(self, player, method):
+        def wrapper(*args):
+            if self.recording:
+                return method(*args)
+            self.recording = True
+            calls, seconds = dict(self.calls), dict(self.seconds)
+            probes, hits = self.tt_probes, self.tt_hits
+            start = time.perf_counter()
+            try:
+                move = method(*args)
+            finally:
+                self.recording = False
+            self.record_move(player, time.perf_counter() - start, calls, seconds, probes, hits)
+            return move
+        return wrapper
+
+    #Wraps one bound method so that each call is counted and its self time added to its phase and stack.
+    def timed(self, name, method):
+        frames, calls, seconds, stacks = self.frames, self.calls, self.seconds, self.stacks
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            stack = f'{frames[-1][0]};{name}' if len(frames) > 1 else name
+            frame = [stack, 0.0]
+            frames.append(frame)
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                elapsed = clock() - start
+                frames.pop()
+                frames[-1][1] += elapsed
+                own = elapsed - frame[1]
+                calls[name] += 1
+                seconds[name] += own
+                stacks[stack] = stacks.get(stack, 0.0) + own
+        return wrapper
+
+    def record_move(self, player, elapsed, calls_before, seconds_before, probes_before, hits_before):
+        search = player.last_search or {}
+        if search.get('book'):
+            source = 'book'
+        elif search.get('tablebase'):
+            source = 'tablebase'
+        elif 'threats' in search:
+            source = 'threats'
+        else:
+            source = 'search'
+        phases = {}
+        for name, phase in PHASES.items():
+            phases[phase] = phases.get(phase, 0.0) + self.seconds[name] - seconds_before[name]
+        record = {'ply': len(self.moves), 'source': source, 'move': search.get('move'), 'seconds': elapsed,
+                  'depth': search.get('depth', 0), 'nodes': search.get('nodes', 0),
+                  'leaves': search.get('leaves', 0), 'cutoffs': search.get('cutoffs', 0),
+                  'researches': search.get('researches', 0),
+                  'tt_probes': self.tt_probes - probes_before, 'tt_hits': self.tt_hits - hits_before,
+                  'calls': {name: self.calls[name] - calls_before[name] for name in PHASES
+                            if self.calls[name] != calls_before[name]},
+                  'phases': phases}
+        self.moves.append(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+
+    def phase_totals(self):
+        """ Seconds per phase over every move so far. """
+        totals = {}
+        for name, phase in PHASES.items():
+            totals[phase] = totals.get(phase, 0.0) + self.seconds[name]
+        return totals
+
+    def write_folded(self, path):
+        """ Writes the call stacks in the folded format, weighted in microseconds. """
+        with open(path, 'w') as output:
+            for stack, seconds in sorted(self.stacks.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds > 0:
+                    output.write(f'{stack} {microseconds}\n')
@@ -0,0 +1,205 @@
+""" Headless self-play matches between two TeekoPlayer configurations.
+
+Each game starts from a random opening (a few random drops chosen by the
+game's seed) and is then played out by the two players alone. Every opening
+is played twice with the colors swapped, so neither configuration gets the
+luckier openings or the first move more often. Games run in a process pool.
+
+A configuration is a comma-separated list of key=value settings:
+
+    depth     deepest iterative deepening iteration (default TeekoPlayer.MAX_DEPTH)
+    time      seconds per move (default TeekoPlayer.TIME_BUDGET)
+    two, three, center, mobility
+              heuristic weights (default game.DEFAULT_WEIGHTS)
+    engine    minimax (default) or mcts (see mcts.py)
+    exploration, batch
+              the Monte Carlo search's UCT exploration constant and playouts per
+              expanded node
+
+The report gives A's wins, draws and losses, its score with a 95% confidence
+interval, the Elo difference that score implies (with the same interval) and
+the 50th/95th/99th percentile time per move of each configuration.
+
+Usage:
+    python selfplay.py --a depth=4 --b depth=3 [--games 1000] [--workers 4]
+                       [--opening-plies 4] [--seed 0] [--output selfplay.json]
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import DEFAULT_WEIGHTS, TeekoPlayer
+from mcts import MCTSSearch
+
+MAX_PLIES = 200  # a game that hasn't been won after this many plies is a draw
+Z_95 = 1.96
+
+
+def parse_config(text):
+    """ Turns 'depth=4,time=0.5,three=3' into a configuration dict. """
+    config = {}
+    for item in filter(None, text.split(',')):
+        key, value = item.split('=')
+        key = key.strip()
+        if key in ('depth', 'batch'):
+            config[key] = int(value)
+        elif key in ('time', 'exploration') or key in DEFAULT_WEIGHTS:
+            config[key] = float(value)
+        elif key == 'engine' and value.strip() in ('minimax', 'mcts'):
+            config[key] = value.strip()
+        else:
+            raise ValueError(f"unknown setting {key!r}")
+    return config
+
+
+def make_player(config, piece):
+    weights = {key: value for key, value in config.items() if key in DEFAULT_WEIGHTS}
+    mcts = None
+    if config.get('engine') == 'mcts':
+        mcts = MCTSSearch(**{name: config[key] for key, name in (('exploration', 'exploration'), ('batch', 'batch_size'))
+                             if key in config})
+    player = TeekoPlayer(weights=weights, mcts=mcts)
+    player.my_piece = piece
+    player.opp = 'r' if piece == 'b' else 'b'
+    return player
+
+
+def random_opening(seed, plies):
+    """ A board with plies random drops, alternating black and red, black first. """
+    rng = random.Random(seed)
+    state = [[' ' for col in range(5)] for row in range(5)]
+    for ply, square in enumerate(rng.sample(range(25), plies)):
+        state[square // 5][square % 5] = 'b' if ply % 2 == 0 else 'r'
+    return state
+
+
+def play_game(config_black, config_red, seed, opening_plies):
+    """ Plays one game and returns (winner 'b', 'r' or None for a draw, plies played,
+    {piece: [seconds per move]}).
+    """
+    state = random_opening(seed, opening_plies)
+    players = {'b': make_player(config_black, 'b'), 'r': make_player(config_red, 'r')}
+    configs = {'b': config_black, 'r': config_red}
+    times = {'b': [], 'r': []}
+    piece = 'b' if opening_plies % 2 == 0 else 'r'
+    for ply in range(opening_plies, MAX_PLIES):
+        player = players[piece]
+        start = time.perf_counter()
+        move = player.make_move(state, configs[piece].get('time'), configs[piece].get('depth'))
+        times[piece].append(time.perf_counter() - start)
+        if len(move) > 1:
+            state[move[1][0]][move[1][1]] = ' '
+        state[move[0][0]][move[0][1]] = piece
+        if player.game_value(state) == 1:
+            return piece, ply + 1, times
+        piece = player.opp
+    return None, MAX_PLIES, times
+
+
+#Runs one opening with A as black; swapped plays it with A as red. Returns A's result (1, 0.5 or 0), plies
+#and A's and B's move times.
+def _play_pairing(config_a, config_b, seed, opening_plies, swapped):
+    if swapped:
+        winner, plies, times = play_game(config_b, config_a, seed, opening_plies)
+        a_piece = 'r'
+    else:
+        winner, plies, times = play_game(config_a, config_b, seed, opening_plies)
+        a_piece = 'b'
+    b_piece = 'r' if a_piece == 'b' else 'b'
+    result = 0.5 if winner is None else float(winner == a_piece)
+    return result, plies, times[a_piece], times[b_piece]
+
+
+def percentile(values, q):
+    """ The q-th percentile (0-100) of values by the nearest-rank method. """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def elo_difference(score):
+    """ Elo difference implied by an expected score, clamped to +-1000 at the extremes. """
+    if score <= 0:
+        return -1000.0
+    if score >= 1:
+        return 1000.0
+    return max(-1000.0, min(1000.0, -400 * math.log10(1 / score - 1)))
+
+
+def summarize(results):
+    """ Win/draw/loss counts, score and Elo with 95% confidence intervals and latency
+    percentiles from a list of _play_pairing results.
+    """
+    scores = [result for result, plies, a_times, b_times in results]
+    games = len(scores)
+    mean = sum(scores) / games
+    variance = sum((score - mean) ** 2 for score in scores) / (games - 1) if games > 1 else 0.0
+    margin = Z_95 * math.sqrt(variance / games)
+    low, high = max(0.0, mean - margin), min(1.0, mean + margin)
+    a_times = [seconds for result in results for seconds in result[2]]
+    b_times = [seconds for result in results for seconds in result[3]]
+    return {'games': games,
+            'wins': scores.count(1.0), 'draws': scores.count(0.5), 'losses': scores.count(0.0),
+            'score': mean, 'score_ci': [low, high],
+            'elo': elo_difference(mean), 'elo_ci': [elo_difference(low), elo_difference(high)],
+            'mean_plies': sum(result[1] for result in results) / games,
+            'latency': {name: {f'p{q}': percentile(times, q) for q in (50, 95, 99)}
+                        for name, times in (('a', a_times), ('b', b_times))}}
+
+
+def run_match(config_a, config_b, games=100, workers=1, opening_plies=4, seed=0, progress=None):
+    """ Plays games games (rounded up to pairs of color-swapped games) and returns summarize's report. """
+    pairings = [(seed + index, swapped) for index in range((games + 1) // 2) for swapped in (False, True)]
+    results = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_play_pairing, config_a, config_b, game_seed, opening_plies, swapped)
+                   for game_seed, swapped in pairings]
+        for future in futures:
+            results.append(future.result())
+            if progress is not None:
+                progress(len(results), len(futures))
+    return summarize(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play two TeekoPlayer configurations against each other.")
+    parser.add_argument('--a', default='', help="configuration A, e.g. depth=4,time=1")
+    parser.add_argument('--b', default='', help="configuration B")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1, help="processes playing games in parallel")
+    parser.add_argument('--opening-plies', type=int, default=4, help="random drops before the players take over")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first opening")
+    parser.add_argument('--output', default=None, help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    config_a, config_b = parse_config(args.a), parse_config(args.b)
+    start = time.perf_counter()
+
+    def progress(done, total):
+        if done % 50 == 0 or done == total:
+            print(f"[{time.perf_counter() - start:.0f}s] {done}/{total} games", file=sys.stderr)
+
+    report = run_match(config_a, config_b, args.games, args.workers, args.opening_plies, args.seed, progress)
+    report['a'], report['b'] = config_a, config_b
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    print(f"A {config_a} vs B {config_b}: {report['games']} games")
+    print(f"A: +{report['wins']} ={report['draws']} -{report['losses']}  "
+          f"score {report['score']:.3f} [{report['score_ci'][0]:.3f}, {report['score_ci'][1]:.3f}]  "
+          f"Elo {report['elo']:+.0f} [{report['elo_ci'][0]:+.0f}, {report['elo_ci'][1]:+.0f}]")
+    for name in ('a', 'b'):
+        latency = report['latency'][name]
+        print(f"{name.upper()} seconds per move: " +
+              "  ".join(f"{q} {'-' if value is None else f'{value:.4f}'}" for q, value in latency.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
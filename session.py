@@ -0,0 +1,160 @@
+""" Hosting many Teeko games in one process.
+
+A GameSession keeps any number of games, each in a small record: both colors'
+bitboards packed into one int and the color to move. Searches run on a pool of
+worker processes, each with its own long-lived TeekoPlayer (and transposition
+table, shared by every game it searches), and best_move is a coroutine, so an
+asyncio server can keep thousands of games going without blocking its event
+loop:
+
+    session = GameSession(workers=4)
+    game_id = session.new_game()
+    session.play(game_id, [(2, 2)])                  # black drops in the middle
+    loop = asyncio.get_running_loop()
+    move = await session.best_move(game_id, loop.time() + 1.0)
+    session.play(game_id, move)                      # red's reply
+
+Moves use the same [(row, col), (source_row, source_col)] format as
+TeekoPlayer.make_move.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import (NUM_SQUARES, PIECES_PER_SIDE, TeekoPlayer, decode_move, decode_state, encode_move,
+                  generate_moves, has_win)
+
+COLORS = ('b', 'r')
+_COLOR_MASK = (1 << NUM_SQUARES) - 1
+
+
+class GameRecord:
+    """ One game: board holds black's bits in the low 25 bits and red's above them,
+    turn is the index into COLORS of the side to move, winner its color once decided.
+    """
+    __slots__ = ('board', 'turn', 'winner')
+
+    def __init__(self):
+        self.board = 0
+        self.turn = 0
+        self.winner = None
+
+    def bits(self, color):
+        return self.board >> (NUM_SQUARES * color) & _COLOR_MASK
+
+    def mover_bits(self):
+        """ (bits of the side to move, bits of the other side). """
+        return self.bits(self.turn), self.bits(1 - self.turn)
+
+
+# each worker (process or thread) searches with its own player, created on first use
+_worker = threading.local()
+
+
+def _worker_player(tt_bytes, cache_path):
+    if getattr(_worker, 'player', None) is None:
+        position_cache = None
+        if cache_path is not None:
+            from position_cache import PositionCache
+            position_cache = PositionCache.load(cache_path)
+        _worker.player = TeekoPlayer(tt_bytes=tt_bytes, position_cache=position_cache)
+    return _worker.player
+
+
+#Runs in a worker: the bits of the best move for mover, searched until the wall-clock deadline (time.time()).
+#The budget is worked out only now, so time spent waiting in the executor's queue counts against it; a task that
+#starts after its deadline only gets the depth 1 search.
+def _search_position(mover, other, deadline, max_depth, tt_bytes, cache_path):
+    time_budget = deadline - time.time()
+    if time_budget <= 0:
+        time_budget, max_depth = 0, 1
+    return _worker_player(tt_bytes, cache_path).choose_move(mover, other, time_budget, max_depth)
+
+
+class GameSession:
+    """ Any number of concurrent games sharing one pool of searching workers. """
+
+    DEADLINE_MARGIN = 0.05  # seconds left before the deadline for handing the result back
+
+    def __init__(self, workers=1, executor=None, tt_bytes=16 * 1024 * 1024, max_depth=None, cache_path=None):
+        """
+        Args:
+            workers (int): number of worker processes searching moves.
+            executor (Executor): pool to search on instead of starting worker processes.
+            tt_bytes (int): transposition table size of each worker's player.
+            max_depth (int): deepest iteration of each search, TeekoPlayer.MAX_DEPTH by default.
+            cache_path (str): a persistent position cache (see position_cache.py) every worker
+                maps and shares, so that what one worker searched the others reuse.
+        """
+        self.executor = executor if executor is not None else ProcessPoolExecutor(workers)
+        self.owns_executor = executor is None
+        self.tt_bytes = tt_bytes
+        self.max_depth = max_depth
+        self.cache_path = cache_path
+        self.games = {}
+        self.ids = itertools.count()
+
+    def new_game(self):
+        """ Starts a game on an empty board with black to move and returns its id. """
+        game_id = next(self.ids)
+        self.games[game_id] = GameRecord()
+        return game_id
+
+    def end_game(self, game_id):
+        del self.games[game_id]
+
+    def state(self, game_id):
+        """ The game's board in the list of lists format. """
+        record = self.games[game_id]
+        return decode_state({color: record.bits(index) for index, color in enumerate(COLORS)})
+
+    def to_move(self, game_id):
+        return COLORS[self.games[game_id].turn]
+
+    def winner(self, game_id):
+        return self.games[game_id].winner
+
+    def play(self, game_id, move):
+        """ Validates move for the side to move and plays it. """
+        record = self.games[game_id]
+        if record.winner is not None:
+            raise Exception("The game is over")
+        mover, other = record.mover_bits()
+        bits = encode_move(move)
+        # a drop is written as one tuple, a slide as two; they must match the mover's phase
+        if (len(move) == 1) != (mover.bit_count() < PIECES_PER_SIDE) or bits not in generate_moves(mover, other):
+            raise Exception("Illegal move detected")
+        record.board ^= bits << (NUM_SQUARES * record.turn)
+        if has_win(mover ^ bits):
+            record.winner = COLORS[record.turn]
+        record.turn = 1 - record.turn
+
+    async def best_move(self, game_id, deadline):
+        """ Searches the best move for the side to move without blocking the event loop.
+
+        Args:
+            game_id: a game started with new_game.
+            deadline (float): time on the running event loop's clock (loop.time()) by
+                which the move is needed. Time the search spends waiting for a free
+                worker counts against it; past the deadline only a depth 1 search is run.
+
+        Returns:
+            the move in the [(row, col), (source_row, source_col)] format; it is not played.
+        """
+        record = self.games[game_id]
+        if record.winner is not None:
+            raise Exception("The game is over")
+        mover, other = record.mover_bits()
+        loop = asyncio.get_running_loop()
+        # workers can't see the event loop's clock, so the deadline is passed as wall-clock time
+        wall_deadline = time.time() + (deadline - loop.time()) - self.DEADLINE_MARGIN
+        move = await loop.run_in_executor(self.executor, _search_position, mover, other, wall_deadline,
+                                          self.max_depth, self.tt_bytes, self.cache_path)
+        return decode_move(mover, move)
+
+    def close(self):
+        """ Stops the worker processes if this session started them. """
+        if self.owns_executor:
+            self.executor.shutdown(cancel_futures=True)
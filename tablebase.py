@@ -0,0 +1,262 @@
+""" Endgame tablebase for the Teeko move phase.
+
+Once all eight pieces are down the game has a fixed, finite set of positions:
+C(25,4) placements of the side to move times C(21,4) placements of its
+opponent. This module solves all of them by retrograde analysis and stores the
+result in one byte per position, so that TeekoPlayer can play the move phase
+perfectly with a handful of table reads.
+
+Positions are always seen from the side to move: mover holds the bits of the
+player about to move and other the bits of its opponent. A position's index is
+
+    rank(mover) * C(21,4) + rank(other on the 21 squares mover leaves free)
+
+where rank is the combinatorial number system, a perfect ranking of 4-subsets.
+Only the canonical image of each position (see game.canonical_form) is solved
+and stored; lookups canonicalize first.
+
+Each byte holds 0 for a draw (neither side can force a win), or 1 + d where d
+is the number of plies until the game ends with best play: d even means the
+side to move loses (d = 0 means the opponent has already won), d odd means it
+wins.
+
+File layout: 4 byte magic b'TKOT', uint16 version, then one byte per index.
+The file is memory-mapped when loaded, so several processes share one copy.
+
+Usage:
+    python tablebase.py build [--output tablebase.bin]
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from itertools import combinations
+from math import comb
+
+from game import (NEIGHBOR_MASKS, FULL_BOARD, NUM_SQUARES, bit_successors, canonical_form, has_win,
+                  iter_squares, stabilizer, transform_bits)
+
+TABLEBASE_MAGIC = b'TKOT'
+TABLEBASE_VERSION = 1
+_HEADER = struct.Struct('<4sH')
+DEFAULT_TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebase.bin')
+
+PIECES = 4
+MOVER_COUNT = comb(NUM_SQUARES, PIECES)
+OTHER_COUNT = comb(NUM_SQUARES - PIECES, PIECES)
+POSITION_COUNT = MOVER_COUNT * OTHER_COUNT
+
+# game results from the side to move's point of view, as in game_value
+WIN, DRAW, LOSS = 1, 0, -1
+
+
+#Every 4-subset of n squares as a bitmask, listed in combinatorial number system order, plus the inverse mapping.
+def _build_combinations(n):
+    subsets = sorted(combinations(range(n), PIECES), key=lambda squares: sum(comb(s, k + 1) for k, s in enumerate(squares)))
+    masks = [sum(1 << square for square in squares) for squares in subsets]
+    return masks, {mask: rank for rank, mask in enumerate(masks)}
+
+
+MOVER_MASKS, MOVER_RANKS = _build_combinations(NUM_SQUARES)
+OTHER_MASKS, OTHER_RANKS = _build_combinations(NUM_SQUARES - PIECES)
+# for each mover placement, the squares it leaves free in increasing order
+FREE_SQUARES = [tuple(iter_squares(FULL_BOARD & ~mover)) for mover in MOVER_MASKS]
+OTHER_SQUARES = [tuple(iter_squares(mask)) for mask in OTHER_MASKS]
+
+
+def position_index(mover, other):
+    """ Index of a move phase position (not canonicalized). """
+    compressed = 0
+    for square in iter_squares(other):
+        # renumber the square among the 21 squares mover leaves free
+        compressed |= 1 << (square - (mover & ((1 << square) - 1)).bit_count())
+    return MOVER_RANKS[mover] * OTHER_COUNT + OTHER_RANKS[compressed]
+
+
+def position_at(index):
+    """ The (mover, other) position at an index, the inverse of position_index. """
+    mover_rank, other_rank = divmod(index, OTHER_COUNT)
+    free = FREE_SQUARES[mover_rank]
+    other = 0
+    for compressed in OTHER_SQUARES[other_rank]:
+        other |= 1 << free[compressed]
+    return MOVER_MASKS[mover_rank], other
+
+
+def canonical_index(mover, other):
+    mover, other, symmetry = canonical_form(mover, other)
+    return position_index(mover, other)
+
+
+def count_moves(mover, other):
+    empty = FULL_BOARD & ~(mover | other)
+    return sum((NEIGHBOR_MASKS[square] & empty).bit_count() for square in iter_squares(mover))
+
+
+#The positions one ply before (mover, other): other just moved, so put one of its pieces back on an adjacent empty square.
+#Yields (mover, other) of the earlier position, where the earlier mover is this position's other.
+def unmoves(mover, other):
+    empty = FULL_BOARD & ~(mover | other)
+    for square in iter_squares(other):
+        lifted = other ^ (1 << square)
+        for source in iter_squares(NEIGHBOR_MASKS[square] & empty):
+            yield lifted | (1 << source), mover
+
+
+def build_tablebase(progress=None):
+    """ Solves every canonical move phase position and returns the table as a bytearray.
+
+    First every canonical position is classified: lost if the opponent already has
+    a win, otherwise its number of legal moves is recorded. Then results are
+    propagated backwards one ply at a time. A predecessor of a lost position is won
+    one ply later. A predecessor of a won position has one fewer move left that
+    doesn't lose, and is lost once none are left. Whatever is never reached this way
+    is a draw. Going ply by ply means wins get the shortest distance and losses
+    the longest.
+    """
+    values = bytearray(POSITION_COUNT)
+    remaining = bytearray(POSITION_COUNT)
+    layer = array('I')
+
+    for mover_rank, mover in enumerate(MOVER_MASKS):
+        # a position is canonical only if no symmetry makes it smaller, which usually
+        # shows up in the mover's bits alone and then rules out all 5985 placements of other
+        if any(transform_bits(mover, symmetry) < mover for symmetry in range(1, 8)):
+            continue
+        mover_symmetries = [symmetry for symmetry in range(1, 8) if transform_bits(mover, symmetry) == mover]
+        free = FREE_SQUARES[mover_rank]
+        base = mover_rank * OTHER_COUNT
+        mover_won = has_win(mover)
+        for other_rank, squares in enumerate(OTHER_SQUARES):
+            other = 1 << free[squares[0]] | 1 << free[squares[1]] | 1 << free[squares[2]] | 1 << free[squares[3]]
+            if any(transform_bits(other, symmetry) < other for symmetry in mover_symmetries):
+                continue
+            if has_win(other):
+                values[base + other_rank] = 1
+                layer.append(base + other_rank)
+            elif not mover_won:
+                remaining[base + other_rank] = count_moves(mover, other)
+        if progress is not None and mover_rank % 500 == 0:
+            progress(f"classified {mover_rank}/{MOVER_COUNT} mover placements")
+
+    distance = 0
+    while layer:
+        if distance + 2 > 255:
+            raise OverflowError("distance to the end of the game does not fit in a byte")
+        if progress is not None:
+            progress(f"distance {distance}: {len(layer)} positions")
+        next_layer = array('I')
+        lost = distance % 2 == 0
+        for index in layer:
+            mover, other = position_at(index)
+            # how many of each predecessor's moves lead to this position (up to symmetry)
+            edges = {}
+            for previous_mover, previous_other in unmoves(mover, other):
+                if has_win(previous_mover):
+                    continue  # the game would already have been over
+                previous_mover, previous_other, symmetry = canonical_form(previous_mover, previous_other)
+                previous = position_index(previous_mover, previous_other)
+                if values[previous]:
+                    continue
+                if lost:
+                    values[previous] = distance + 2
+                    next_layer.append(previous)
+                elif previous in edges:
+                    edges[previous][0] += 1
+                else:
+                    edges[previous] = [1, previous_mover, previous_other]
+            if lost:
+                continue
+            # unmoves from this one representative count the moves from each predecessor's whole orbit into it;
+            # scaling by the ratio of orbit sizes gives the moves from the predecessor into this position's orbit
+            own_symmetries = 1 + len(stabilizer(mover, other))
+            for previous, (count, previous_mover, previous_other) in edges.items():
+                moves = count * (1 + len(stabilizer(previous_mover, previous_other))) // own_symmetries
+                remaining[previous] -= moves
+                if remaining[previous] == 0:
+                    values[previous] = distance + 2
+                    next_layer.append(previous)
+        layer = next_layer
+        distance += 1
+    return values
+
+
+def save_tablebase(values, path=DEFAULT_TABLEBASE_PATH):
+    with open(path, 'wb') as table_file:
+        table_file.write(_HEADER.pack(TABLEBASE_MAGIC, TABLEBASE_VERSION))
+        table_file.write(values)
+
+
+class Tablebase:
+    """ Read access to a solved move phase table, memory-mapped from disk. """
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    @classmethod
+    def load(cls, path=DEFAULT_TABLEBASE_PATH):
+        with open(path, 'rb') as table_file:
+            data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack(data[:_HEADER.size])
+        if magic != TABLEBASE_MAGIC or version != TABLEBASE_VERSION:
+            raise ValueError(f"{path} is not a version {TABLEBASE_VERSION} tablebase")
+        if len(data) != _HEADER.size + POSITION_COUNT:
+            raise ValueError(f"{path} is truncated")
+        return cls(data, _HEADER.size)
+
+    def probe(self, mover, other):
+        """ Returns (result, distance) for mover to move: result is WIN, DRAW or LOSS
+        and distance the number of plies until the game ends (None for a draw).
+        """
+        value = self.data[self.offset + canonical_index(mover, other)]
+        if value == 0:
+            return DRAW, None
+        distance = value - 1
+        return (WIN if distance % 2 else LOSS), distance
+
+    def best_move(self, mover, other, tie_break=None):
+        """ The perfect move for mover, as the bits it flips: the fastest win if there is
+        one, otherwise a drawing move, otherwise the slowest loss. Among equally good
+        moves the one with the highest tie_break(child bits) wins.
+        """
+        best_score, best_move = None, None
+        for child in bit_successors(mover, other):
+            result, distance = self.probe(other, child)
+            # the result is from the opponent's point of view after our move
+            if result == LOSS:
+                score = (2, -distance)
+            elif result == DRAW:
+                score = (1, 0)
+            else:
+                score = (0, distance)
+            if tie_break is not None:
+                score += (tie_break(child),)
+            if best_score is None or score > best_score:
+                best_score, best_move = score, mover ^ child
+        return best_move
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve the Teeko move phase by retrograde analysis.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="solve every move phase position and write the table")
+    build.add_argument('--output', default=DEFAULT_TABLEBASE_PATH)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def progress(message):
+        print(f"[{time.perf_counter() - start:.0f}s] {message}", file=sys.stderr)
+
+    values = build_tablebase(progress)
+    save_tablebase(values, args.output)
+    solved = sum(1 for value in values if value)
+    print(f"Wrote {args.output}: {solved} decided positions out of {POSITION_COUNT} indices")
+
+
+if __name__ == "__main__":
+    main()